@@ -0,0 +1,167 @@
+"""Operational indicators computed in SQL: MTTR, technician throughput, equipment MTBF.
+
+Every function takes a cursor on a database holding the interventions side of the schema,
+a company id and a filter dict (date_from / date_to as YYYY-MM-DD strings, optional
+customer_id and priority) and returns plain JSON-serialisable dicts. Failures and
+repairs are the corrective interventions of corrective_sql().
+"""
+
+WORKDAY_MINUTES = 7 * 60
+
+
+def _filters_sql(filters, date_column, alias="i"):
+    """WHERE fragment (without the company condition) and its parameters."""
+    sql = f" AND {alias}.{date_column} >= ? AND {alias}.{date_column} < date(?, '+1 day')"
+    params = [filters["date_from"], filters["date_to"]]
+    if filters.get("customer_id"):
+        sql += f" AND {alias}.customer_id = ?"
+        params.append(filters["customer_id"])
+    if filters.get("priority"):
+        sql += f" AND {alias}.priority = ?"
+        params.append(filters["priority"])
+    return sql, params
+
+
+def corrective_sql(alias="i"):
+    """SQL condition matching corrective interventions (breakdowns and their repairs).
+
+    kind = 'corrective', plus interventions saved without a kind: the field is optional
+    and untyped interventions are mostly call-outs. Preventive visits and installations
+    are never failures.
+    """
+    column = f"{alias}.kind" if alias else "kind"
+    return f"({column} = 'corrective' OR COALESCE({column}, '') = '')"
+
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+
+def mean_time_to_repair(c, company_id, filters):
+    """Repair time of completed corrective interventions, overall and per month.
+
+    Repair time runs from started_at (created_at when the technician never started it)
+    to completed_at; response time from created_at to started_at.
+    """
+    where, params = _filters_sql(filters, "completed_at")
+    c.execute(f"""
+        WITH repairs AS (
+            SELECT (julianday(i.completed_at) - julianday(COALESCE(i.started_at, i.created_at))) * 24 AS repair_h,
+                   CASE WHEN i.started_at IS NOT NULL
+                        THEN (julianday(i.started_at) - julianday(i.created_at)) * 24 END AS response_h
+            FROM interventions i
+            WHERE i.company_id = ? AND i.status = 'done' AND i.completed_at IS NOT NULL
+              AND {corrective_sql()} {where}
+        ),
+        ranked AS (
+            SELECT repair_h, response_h,
+                   ROW_NUMBER() OVER (ORDER BY repair_h) AS rn,
+                   COUNT(*) OVER () AS n
+            FROM repairs
+            WHERE repair_h >= 0
+        )
+        SELECT COUNT(*) AS n,
+               AVG(repair_h) AS mean_h,
+               MAX(CASE WHEN rn = (n + 1) / 2 THEN repair_h END) AS median_h,
+               MAX(CASE WHEN rn = (9 * n + 9) / 10 THEN repair_h END) AS p90_h,
+               AVG(response_h) AS response_h
+        FROM ranked
+    """, [company_id] + params)
+    overall = c.fetchone()
+    c.execute(f"""
+        SELECT strftime('%Y-%m', i.completed_at) AS month,
+               COUNT(*) AS n,
+               AVG((julianday(i.completed_at) - julianday(COALESCE(i.started_at, i.created_at))) * 24) AS mean_h
+        FROM interventions i
+        WHERE i.company_id = ? AND i.status = 'done' AND i.completed_at IS NOT NULL
+          AND {corrective_sql()}
+          AND julianday(i.completed_at) >= julianday(COALESCE(i.started_at, i.created_at)) {where}
+        GROUP BY month
+        ORDER BY month
+    """, [company_id] + params)
+    return {
+        "count": overall["n"],
+        "mean_hours": _round(overall["mean_h"]),
+        "median_hours": _round(overall["median_h"]),
+        "p90_hours": _round(overall["p90_h"]),
+        "mean_response_hours": _round(overall["response_h"]),
+        "by_month": [{"month": r["month"], "count": r["n"], "mean_hours": _round(r["mean_h"])} for r in c.fetchall()],
+    }
+
+
+def technician_throughput(c, company_id, filters, working_days):
+    """Completed interventions and logged time per assignee over the period.
+
+    time_spent_minutes is split evenly between the assignees of an intervention;
+    utilisation is that time over `working_days` * WORKDAY_MINUTES.
+    """
+    where, params = _filters_sql(filters, "completed_at")
+    c.execute(f"""
+        WITH shares AS (
+            SELECT ia.user_id,
+                   i.id AS intervention_id,
+                   COALESCE(i.time_spent_minutes, 0) * 1.0
+                       / COUNT(*) OVER (PARTITION BY i.id) AS minutes
+            FROM interventions i
+            JOIN intervention_assignees ia ON ia.intervention_id = i.id
+            WHERE i.company_id = ? AND i.status = 'done' AND i.completed_at IS NOT NULL {where}
+        ),
+        per_tech AS (
+            SELECT user_id, COUNT(*) AS completed, SUM(minutes) AS minutes
+            FROM shares
+            GROUP BY user_id
+        )
+        SELECT p.user_id, u.username, p.completed, p.minutes,
+               RANK() OVER (ORDER BY p.completed DESC) AS rank,
+               p.completed * 1.0 / SUM(p.completed) OVER () AS share
+        FROM per_tech p
+        LEFT JOIN users u ON u.id = p.user_id
+        ORDER BY rank, u.username
+    """, [company_id] + params)
+    available = working_days * WORKDAY_MINUTES
+    return {
+        "working_days": working_days,
+        "technicians": [{
+            "user_id": r["user_id"],
+            "username": r["username"],
+            "completed": r["completed"],
+            "time_spent_minutes": round(r["minutes"] or 0),
+            "utilisation": _round((r["minutes"] or 0) / available, 4) if available else None,
+            "completed_share": _round(r["share"], 4),
+            "rank": r["rank"],
+        } for r in c.fetchall()],
+    }
+
+
+def equipment_failures(c, company_id, filters, limit=50):
+    """Corrective interventions per equipment and mean time between them (MTBF, days)."""
+    where, params = _filters_sql(filters, "created_at")
+    c.execute(f"""
+        WITH failures AS (
+            SELECT i.equipment_id, i.created_at,
+                   julianday(i.created_at)
+                       - julianday(LAG(i.created_at) OVER (PARTITION BY i.equipment_id ORDER BY i.created_at)) AS gap_days
+            FROM interventions i
+            WHERE i.company_id = ? AND i.equipment_id IS NOT NULL
+              AND {corrective_sql()} {where}
+        )
+        SELECT f.equipment_id, e.name, e.reference,
+               COUNT(*) AS failures,
+               AVG(f.gap_days) AS mtbf_days,
+               MAX(f.created_at) AS last_failure_at
+        FROM failures f
+        LEFT JOIN equipments e ON e.id = f.equipment_id
+        GROUP BY f.equipment_id
+        ORDER BY failures DESC, mtbf_days
+        LIMIT ?
+    """, [company_id] + params + [limit])
+    return {
+        "equipments": [{
+            "equipment_id": r["equipment_id"],
+            "name": r["name"],
+            "reference": r["reference"],
+            "failures": r["failures"],
+            "mtbf_days": _round(r["mtbf_days"]),
+            "last_failure_at": r["last_failure_at"],
+        } for r in c.fetchall()],
+    }
@@ -1,25 +1,113 @@
 
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, send_from_directory, jsonify, flash, g, has_request_context
 from datetime import datetime, timedelta
 import sqlite3
 import re
+import unicodedata
 import os
 import csv
 import io
-import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import zlib
+from urllib.parse import quote
 import smtplib
 import ssl
 from email.message import EmailMessage
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from ai.scheduler import suggest_priorities
+from analytics import operations as analytics_ops
 import secrets
-from werkzeug.security import check_password_hash, generate_password_hash
+import tempfile
+import threading
+import queue
+from collections import OrderedDict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash, generate_password_hash, safe_join
 from flask_wtf.csrf import CSRFProtect, generate_csrf
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz variants are produced without it
+    brotli = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: proofs are listed without thumbnails
+    Image = ImageOps = None
 
 BASE_DIR = os.path.dirname(__file__)
-DATABASE = os.path.join(BASE_DIR, "maintcontrol.db")
+DATABASE = os.environ.get("MAINTCONTROL_DB") or os.path.join(BASE_DIR, "maintcontrol.db")
+# Optional database-per-tenant mode: DATABASE keeps companies/users/licensing,
+# each company gets TENANT_DB_DIR/company_<id>.db (see tools/split_tenants.py).
+TENANT_SHARDING = os.environ.get("TENANT_SHARDING", "").lower() in ("1", "true", "yes")
+TENANT_DB_DIR = os.environ.get("TENANT_DB_DIR") or os.path.join(BASE_DIR, "tenants")
+# Connection tuning: writers wait for the lock, readers map the file in memory.
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.environ.get("SQLITE_BUSY_TIMEOUT_SECONDS", "10"))
+SQLITE_READ_MMAP_BYTES = int(os.environ.get("SQLITE_READ_MMAP_BYTES", str(64 * 1024 * 1024)))
+SQLITE_READ_CACHE_KIB = int(os.environ.get("SQLITE_READ_CACHE_KIB", "8192"))
 TRIAL_DAYS = 30
+LOGIN_WINDOW_SECONDS = 600        # sliding window for counting failed logins
+LOGIN_MAX_FAILURES = 5            # failures within the window before lockout
+LOGIN_LOCKOUT_MINUTES = 15
+LOGIN_PURGE_INTERVAL_SECONDS = 300
+# Reverse proxies in front of the app (Render: 1). Only that many X-Forwarded-For hops,
+# counted from the right, are trusted for the client address used by login rate limiting.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+# Change feed (/api/changes): page size and change_log compaction bounds.
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_LOG_MAX_ROWS = int(os.environ.get("CHANGE_LOG_MAX_ROWS", "200000"))
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get("CHANGE_LOG_RETENTION_DAYS", "30"))
+CHANGE_LOG_COMPACT_INTERVAL_SECONDS = 600
+# Daily statistics rollup: staleness tolerated by /api/stats/daily before it refreshes.
+DAILY_STATS_REFRESH_INTERVAL_SECONDS = 60
+DAILY_STATS_MAX_RANGE_DAYS = 800
+# Form lookups (employees, picker labels) cached per company and data version.
+LOOKUP_CACHE_ENTRIES = 4096
+# Analytics widgets (/api/analytics/*): result cache size and default period.
+ANALYTICS_CACHE_ENTRIES = 512
+ANALYTICS_DEFAULT_DAYS = 90
+# Templates: compiled bytecode shared by workers, rendered table fragments cached per data version.
+JINJA_BYTECODE_DIR = os.environ.get("JINJA_BYTECODE_DIR") or os.path.join(tempfile.gettempdir(), "maintcontrol-jinja")
+FRAGMENT_CACHE_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_ENTRIES", "1024"))
+# Conditional GET on list/dashboard pages: ETags also roll over every window so
+# time-dependent content (late counts, trial banner, CSRF tokens) gets refreshed.
+PAGE_ETAG_WINDOW_SECONDS = 1800
+# Customer list page size (keyset pagination).
+CUSTOMERS_PAGE_SIZE = 50
+# Equipment history pages (keyset pagination).
+EQUIPMENT_HISTORY_PAGE_SIZE = 25
+EQUIPMENT_HISTORY_MAX_PAGE_SIZE = 200
+# Server-Sent Events (/api/events): change_log polling period and keep-alive.
+SSE_POLL_INTERVAL_SECONDS = float(os.environ.get("SSE_POLL_INTERVAL_SECONDS", "1"))
+SSE_HEARTBEAT_SECONDS = 25
+SSE_QUEUE_SIZE = 200
+# Streams need a worker that serves other requests meanwhile (gthread, or the threaded dev
+# server). Set SSE_ASYNC_WORKER=1 for gevent/eventlet workers, which do not report it.
+SSE_ASYNC_WORKER = os.environ.get("SSE_ASYNC_WORKER", "").lower() in ("1", "true", "yes")
+# Streams per worker. Each one holds a gthread thread, so keep this below --threads; past it
+# /api/events answers 204 and the page polls instead.
+SSE_MAX_SUBSCRIBERS = int(os.environ.get("SSE_MAX_SUBSCRIBERS", "8"))
+# Per-endpoint latency and SQL metrics at /metrics (Prometheus text format). Off by default:
+# when disabled no hook is registered and connections are not instrumented.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # optional bearer token for scrapers
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+AUTH_CLAIMS_MAX_AGE_SECONDS = 300  # read-only requests trust session claims at most this long
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR") or os.path.join(BASE_DIR, "uploads")
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# "direct" (Python sends the file), "x-accel" (nginx X-Accel-Redirect) or "x-sendfile" (Apache/lighttpd)
+UPLOAD_SERVE_MODE = os.environ.get("UPLOAD_SERVE_MODE", "direct").lower()
+UPLOAD_ACCEL_PREFIX = os.environ.get("UPLOAD_ACCEL_PREFIX", "/protected-uploads/")
 SUPPORTED_LANGS = ["fr", "en", "es", "de"]
 DEFAULT_LANG = "fr"
 
@@ -30,11 +118,420 @@ app.secret_key = os.environ.get("SECRET_KEY", "CHANGE_THIS_SECRET_KEY")
 if app.secret_key == "CHANGE_THIS_SECRET_KEY" and (os.environ.get("ENV", "").lower() in ("prod", "production") or os.environ.get("RENDER") or os.environ.get("FLASK_ENV") == "production"):
     raise RuntimeError("SECRET_KEY must be set in production")
 
-csrf = CSRFProtect(app)
+# CSRF tokens are masked per rendering: the page HTML is compressed (compress_response)
+# and reflects query parameters, so a constant token would be exposed to BREACH-style
+# length probing. Each csrf_token() call XORs the token with a fresh random pad.
+def mask_csrf_token(token):
+    """Hex of pad + (pad XOR token), different on every call for the same token."""
+    raw = token.encode()
+    pad = secrets.token_bytes(len(raw))
+    return (pad + bytes(a ^ b for a, b in zip(pad, raw))).hex()
+
+def unmask_csrf_token(value):
+    """Inverse of mask_csrf_token(); anything else is returned unchanged for validation."""
+    try:
+        raw = bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return value
+    half = len(raw) // 2
+    if not half or len(raw) % 2:
+        return value
+    try:
+        return bytes(a ^ b for a, b in zip(raw[:half], raw[half:])).decode("ascii")
+    except UnicodeDecodeError:
+        return value
+
+class MaskedCSRFProtect(CSRFProtect):
+    """CSRFProtect reading the masked tokens of the forms and the X-CSRFToken header."""
+
+    def _get_csrf_token(self):
+        return unmask_csrf_token(super()._get_csrf_token())
+
+def masked_csrf_token():
+    return mask_csrf_token(generate_csrf())
+
+csrf = MaskedCSRFProtect(app)
+
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
 @app.context_processor
 def inject_csrf_token():
-    return dict(csrf_token=generate_csrf)
+    return dict(csrf_token=masked_csrf_token)
+
+# ---------- Upload store (content-addressed, sharded by SHA-256 prefix) ----------
+
+# Werkzeug rejects larger bodies with 413 before parsing them.
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+def _uploads_dir():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return UPLOAD_DIR
+
+class HashingUploadFile:
+    """Temporary file that hashes multipart data while Werkzeug streams it to disk.
+
+    The file lives inside the upload directory so storing it is a rename, not a copy.
+    It is removed on close unless store_upload() moved it into place.
+    """
+
+    def __init__(self):
+        tmp_dir = os.path.join(_uploads_dir(), ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.stored = False
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        if not self.stored:
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile()
+
+app.request_class = UploadRequest
+
+def upload_path_for(digest):
+    return os.path.join(_uploads_dir(), digest[:2], digest[2:4], digest)
+
+def store_upload(file_storage):
+    """Move an uploaded file into the content-addressed store.
+
+    Returns (absolute_path, sha256_hex, size_bytes). Identical content is stored once.
+    """
+    stream = file_storage.stream
+    if not isinstance(stream, HashingUploadFile):
+        # Small bodies may be parsed in memory: hash them through the same writer.
+        wrapped = HashingUploadFile()
+        for chunk in iter(lambda: stream.read(64 * 1024), b""):
+            wrapped.write(chunk)
+        stream = wrapped
+    stream.flush()
+    digest = stream.sha256.hexdigest()
+    path = upload_path_for(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(stream.name, path)
+        stream.stored = True
+    stream.close()
+    return path, digest, stream.size
+
+def upload_url(filepath, size=None):
+    """URL of a stored file (flat legacy names and sharded paths alike).
+
+    `size` selects a thumbnail variant (see THUMBNAIL_SIZES).
+    """
+    rel = os.path.relpath(filepath, _uploads_dir()).replace(os.sep, "/")
+    if size:
+        return url_for("serve_upload", filename=rel, size=size)
+    return url_for("serve_upload", filename=rel)
+
+app.jinja_env.globals["upload_url"] = upload_url
+
+# ---------- Thumbnails (proof photos) ----------
+
+THUMBNAIL_SIZES = {"thumb": 320, "preview": 1280}
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg")}
+_thumbnail_executor = None
+_thumbnail_executor_lock = threading.Lock()
+
+def is_thumbnailable(filename):
+    mimetype = mimetypes.guess_type(filename or "")[0] or ""
+    return Image is not None and mimetype.startswith("image/") and mimetype != "image/svg+xml"
+
+def thumbnail_path(path, size, fmt):
+    """Variants are cached next to the original: <original>.<size>.<fmt>."""
+    return f"{path}.{size}.{fmt}"
+
+def generate_thumbnails(path, sizes=None, formats=None):
+    """Write the missing thumbnail variants of `path`; returns False if it is not a readable image.
+
+    Corrupt, truncated or oversized (decompression bomb) files return False, so callers
+    fall back to the original file.
+    """
+    sizes = sizes or list(THUMBNAIL_SIZES)
+    formats = formats or list(THUMBNAIL_FORMATS)
+    todo = [(sz, fmt) for sz in sizes for fmt in formats if not os.path.exists(thumbnail_path(path, sz, fmt))]
+    if not todo:
+        return True
+    tmp = None
+    try:
+        with Image.open(path) as src:
+            # Let the JPEG decoder downscale while decoding: far cheaper for 12 MP photos.
+            src.draft("RGB", (max(THUMBNAIL_SIZES[sz] for sz, _ in todo),) * 2)
+            img = ImageOps.exif_transpose(src).convert("RGB")
+        for sz in sorted({sz for sz, _ in todo}, key=lambda k: -THUMBNAIL_SIZES[k]):
+            edge = THUMBNAIL_SIZES[sz]
+            img = img.copy()
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            for fmt in [f for s2, f in todo if s2 == sz]:
+                target = thumbnail_path(path, sz, fmt)
+                tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+                img.save(tmp, THUMBNAIL_FORMATS[fmt][0], quality=80)
+                os.replace(tmp, target)
+                tmp = None
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        # OSError covers UnidentifiedImageError and truncated data; SyntaxError is raised
+        # by some Pillow decoders on malformed headers.
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        return False
+    return True
+
+def schedule_thumbnails(path, filename):
+    """Generate thumbnails in a per-worker background thread after an upload."""
+    global _thumbnail_executor
+    if not is_thumbnailable(filename):
+        return
+    with _thumbnail_executor_lock:
+        if _thumbnail_executor is None:
+            _thumbnail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+    _thumbnail_executor.submit(generate_thumbnails, path)
+
+app.jinja_env.globals["is_thumbnailable"] = is_thumbnailable
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    flash(f"Fichier trop volumineux (max {MAX_UPLOAD_BYTES // (1024 * 1024)} Mo).", "error")
+    return redirect(request.referrer or url_for("dashboard"))
+
+# ---------- i18n catalogs (loaded once per worker) ----------
+
+def load_i18n_catalogs():
+    """Load every supported catalog into memory.
+
+    Returns (catalogs, payloads): `catalogs[lang]` is the dict used by the Jinja `t()`
+    helper and `payloads[lang]` is (json_bytes, etag) served by the /i18n route.
+    """
+    catalogs, payloads = {}, {}
+    for lang in SUPPORTED_LANGS:
+        path = os.path.join(BASE_DIR, "i18n", f"{lang}.json")
+        try:
+            with open(path, encoding="utf-8") as fp:
+                catalogs[lang] = json.load(fp)
+        except (OSError, ValueError):
+            catalogs[lang] = {}
+        body = json.dumps(catalogs[lang], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        payloads[lang] = (body, hashlib.sha1(body).hexdigest()[:16])
+    return catalogs, payloads
+
+I18N_CATALOGS, I18N_PAYLOADS = load_i18n_catalogs()
+
+def translate(key, lang=None):
+    lang = lang or session.get("lang", DEFAULT_LANG)
+    text = I18N_CATALOGS.get(lang, {}).get(key)
+    if text is None:
+        text = I18N_CATALOGS[DEFAULT_LANG].get(key, key)
+    return text
+
+# ---------- Static assets (fingerprinted URLs + precompressed variants) ----------
+
+STATIC_COMPRESSIBLE_EXTS = (".css", ".js", ".json", ".svg", ".txt", ".html")
+STATIC_MIN_COMPRESS_BYTES = 512
+
+def _write_variant(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp, path)
+
+def static_variant_name(filename, version, ext):
+    """Precompressed variant of a static file: the content hash is part of the name,
+    so a variant can never be served for other content than it was built from."""
+    return f"{filename}.{version}{ext}"
+
+def _remove_stale_variants(path, ext, keep):
+    """Drop variants of `path` built from older content (and unhashed legacy ones)."""
+    folder, name = os.path.split(path)
+    stale = re.compile(re.escape(name) + r"(\.[0-9a-f]{12})?" + re.escape(ext) + "$")
+    for other in os.listdir(folder):
+        if other != keep and stale.match(other):
+            try:
+                os.unlink(os.path.join(folder, other))
+            except OSError:
+                pass
+
+def build_static_manifest(static_dir):
+    """Hash every static file and write .gz/.br siblings for compressible ones.
+
+    Variants are named after the content hash and only written when missing, so the
+    work happens once per content change whatever the file mtimes. Returns
+    {relative_path: short_hash}.
+    """
+    manifest = {}
+    for root, _dirs, files in os.walk(static_dir):
+        for name in files:
+            if name.endswith((".gz", ".br", ".tmp")):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as fp:
+                data = fp.read()
+            manifest[rel] = hashlib.sha256(data).hexdigest()[:12]
+            if not name.endswith(STATIC_COMPRESSIBLE_EXTS) or len(data) < STATIC_MIN_COMPRESS_BYTES:
+                continue
+            variants = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", lambda d: brotli.compress(d, quality=11)))
+            for ext, compress in variants:
+                target = static_variant_name(path, manifest[rel], ext)
+                if os.path.exists(target):
+                    continue
+                try:
+                    _write_variant(target, compress(data))
+                    _remove_stale_variants(path, ext, os.path.basename(target))
+                except OSError:
+                    pass  # read-only filesystem: serve uncompressed
+    return manifest
+
+STATIC_MANIFEST = build_static_manifest(app.static_folder)
+
+def static_url(filename):
+    """url_for('static') with a content hash, so the URL can be cached forever."""
+    version = STATIC_MANIFEST.get(filename)
+    if version is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=version)
+
+app.jinja_env.globals["static_url"] = static_url
+
+def serve_static(filename):
+    """Replacement for Flask's static view: precompressed variants + immutable caching."""
+    version = STATIC_MANIFEST.get(filename)
+    resp = None
+    if version is not None:
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+            variant = static_variant_name(filename, version, ext)
+            if encoding in request.accept_encodings and os.path.exists(os.path.join(app.static_folder, variant)):
+                resp = send_from_directory(app.static_folder, variant, mimetype=mimetype)
+                resp.headers["Content-Encoding"] = encoding
+                break
+    if resp is None:
+        resp = send_from_directory(app.static_folder, filename)
+    if version is not None:
+        resp.vary.add("Accept-Encoding")
+        if request.args.get("v") == version:
+            resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+app.view_functions["static"] = serve_static
+
+# ---------- Response compression ----------
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_MIMETYPES = {
+    "text/html", "text/csv", "text/plain", "text/css",
+    "application/json", "application/javascript", "image/svg+xml",
+}
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4  # dynamic content: favour CPU over ratio
+COMPRESS_STREAM_FLUSH_BYTES = 16384  # input bytes buffered before a streamed chunk is flushed
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        out = z.compress(chunk)
+        pending += len(chunk)
+        if pending >= COMPRESS_STREAM_FLUSH_BYTES:
+            out += z.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield z.flush()
+
+def _brotli_stream(chunks):
+    b = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+    pending = 0
+    for chunk in chunks:
+        out = b.process(chunk)
+        pending += len(chunk)
+        if pending >= COMPRESS_STREAM_FLUSH_BYTES:
+            out += b.flush()
+            pending = 0
+        if out:
+            yield out
+    yield b.finish()
+
+def _encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+@app.after_request
+def compress_response(resp):
+    """Compress eligible responses; streamed bodies are compressed chunk by chunk."""
+    if (resp.mimetype not in COMPRESS_MIMETYPES or request.method == "HEAD"
+            or resp.status_code < 200 or resp.status_code in (204, 206, 304)):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if "Content-Encoding" in resp.headers or "Content-Range" in resp.headers:
+        return resp
+    if resp.content_length is not None and resp.content_length < COMPRESS_MIN_BYTES:
+        return resp
+    accepted = request.accept_encodings
+    if brotli is not None and "br" in accepted:
+        encoding, stream, one_shot = "br", _brotli_stream, lambda d: brotli.compress(d, quality=COMPRESS_BROTLI_QUALITY)
+    elif "gzip" in accepted:
+        encoding, stream, one_shot = "gzip", _gzip_stream, lambda d: gzip.compress(d, COMPRESS_GZIP_LEVEL)
+    else:
+        return resp
+
+    if resp.is_streamed or resp.direct_passthrough:
+        body = resp.response
+        resp.direct_passthrough = False
+        resp.response = stream(_encode_chunks(body))
+        if hasattr(body, "close"):
+            resp.call_on_close(body.close)
+        resp.headers.pop("Content-Length", None)
+    else:
+        data = resp.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return resp
+        resp.set_data(one_shot(data))
+    resp.headers["Content-Encoding"] = encoding
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+# ---------- Password hashing policy ----------
+# Werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Hashes created with another method are upgraded on the next successful login.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_SALT_LENGTH = int(os.environ.get("PASSWORD_SALT_LENGTH", "16"))
+
+def _normalized_hash_method(method):
+    """Return the method prefix Werkzeug actually writes (fills in default parameters)."""
+    return generate_password_hash("", method=method, salt_length=PASSWORD_SALT_LENGTH).split("$", 1)[0]
+
+# Validates the configured policy at startup.
+PASSWORD_HASH_PREFIX = _normalized_hash_method(PASSWORD_HASH_METHOD)
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
+
+def password_needs_rehash(pw_hash):
+    method, _, rest = (pw_hash or "").partition("$")
+    salt = rest.split("$", 1)[0]
+    return method != PASSWORD_HASH_PREFIX or len(salt) != PASSWORD_SALT_LENGTH
 
 # ---------- Date helpers ----------
 
@@ -76,15 +573,169 @@ def normalize_iso_bound(value: str, is_end: bool = False):
 
 # ---------- DB helpers ----------
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+def _timed_sql(method):
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.connection.metrics.sql_seconds += time.perf_counter() - start
+    return wrapper
+
+class MetricsCursor(sqlite3.Cursor):
+    """Cursor adding the time spent executing and fetching to the request's SQL time."""
+
+    execute = _timed_sql(sqlite3.Cursor.execute)
+    executemany = _timed_sql(sqlite3.Cursor.executemany)
+    executescript = _timed_sql(sqlite3.Cursor.executescript)
+    fetchone = _timed_sql(sqlite3.Cursor.fetchone)
+    fetchmany = _timed_sql(sqlite3.Cursor.fetchmany)
+    fetchall = _timed_sql(sqlite3.Cursor.fetchall)
+
+class MetricsConnection(sqlite3.Connection):
+    """Connection reporting to the current request's RequestMetrics.
+
+    Statements are counted by the trace callback; time is measured by MetricsCursor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = g.request_metrics
+        self.set_trace_callback(self.metrics.count_statement)
+
+    def cursor(self, factory=MetricsCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+def _connection_class():
+    """MetricsConnection while the current request is measured, the plain class otherwise."""
+    if METRICS_ENABLED and has_request_context() and "request_metrics" in g:
+        return MetricsConnection
+    return sqlite3.Connection
+
+def _connect(path):
+    """Writer connection: transactions start with BEGIN IMMEDIATE at the first write,
+    so the write lock is taken up front instead of being upgraded mid-transaction."""
+    conn = sqlite3.connect(path, uri=True, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level="IMMEDIATE",
+                           factory=_connection_class())
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _ro_uri(path):
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+def _connect_ro(path):
+    """Reader connection: opened read-only and with query_only, it can never take a write lock."""
+    conn = sqlite3.connect(_ro_uri(path), uri=True, timeout=SQLITE_BUSY_TIMEOUT_SECONDS,
+                           factory=_connection_class())
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_READ_MMAP_BYTES}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_READ_CACHE_KIB}")
     return conn
 
+def get_control_db():
+    """Connection to the database holding companies, users and licensing."""
+    return _connect(DATABASE)
+
+def get_control_read_db():
+    return _connect_ro(DATABASE)
+
+def tenant_db_path(company_id):
+    return os.path.join(TENANT_DB_DIR, f"company_{int(company_id)}.db")
+
+# Shards already migrated by this worker.
+_ready_shards = set()
+
+def _request_company_id():
+    if not has_request_context():
+        return None
+    user = g.get("current_user") or session.get("auth")
+    return user["company_id"] if user else None
+
+def get_db(company_id=None):
+    """Connection for tenant data.
+
+    Without TENANT_SHARDING this is the single database. With it, the connection
+    opens the shard of `company_id` (default: the logged-in user's company) and
+    attaches the control database read-only as `control`; shards have no users/
+    companies/licensing tables, so unqualified names for those resolve to the control
+    database. Read-only keeps BEGIN IMMEDIATE on a shard from also locking control.db,
+    so writers on different shards never wait on each other; control writes go
+    through get_control_db(). Outside of a company context the control database is
+    returned.
+    """
+    if not TENANT_SHARDING:
+        return _connect(DATABASE)
+    if company_id is None:
+        company_id = _request_company_id()
+    if company_id is None:
+        return get_control_db()
+    path = tenant_db_path(company_id)
+    if path not in _ready_shards:
+        os.makedirs(TENANT_DB_DIR, exist_ok=True)
+    conn = _connect(path)
+    conn.execute("ATTACH DATABASE ? AS control", (_ro_uri(DATABASE),))
+    if path not in _ready_shards:
+        conn.execute("PRAGMA main.journal_mode = WAL")
+        c = conn.cursor()
+        migrate_tenant_db(c, users_table="directory_users")
+        sync_user_directory(c, company_id)
+        conn.commit()
+        _ready_shards.add(path)
+    return conn
+
+def get_read_db(company_id=None):
+    """Read-only counterpart of get_db() for GET handlers and exports."""
+    if not TENANT_SHARDING:
+        return _connect_ro(DATABASE)
+    if company_id is None:
+        company_id = _request_company_id()
+    if company_id is None:
+        return get_control_read_db()
+    path = tenant_db_path(company_id)
+    if path not in _ready_shards:
+        get_db(company_id).close()  # creates and migrates the shard
+    conn = _connect_ro(path)
+    conn.execute("ATTACH DATABASE ? AS control", (_ro_uri(DATABASE),))
+    return conn
+
+def get_request_db():
+    """Writer for POST requests, reader otherwise (form pages handling both methods)."""
+    return get_db() if request.method == "POST" else get_read_db()
+
+def sync_user_directory(c, company_id):
+    """Mirror the company's usernames into a shard (its triggers cannot read control.users)."""
+    c.execute("DELETE FROM directory_users WHERE id NOT IN (SELECT id FROM control.users WHERE company_id = ?)",
+              (company_id,))
+    c.execute("""
+        INSERT INTO directory_users (id, username)
+        SELECT id, username FROM control.users WHERE company_id = ?
+        ON CONFLICT(id) DO UPDATE SET username = excluded.username
+        WHERE directory_users.username IS NOT excluded.username
+    """, (company_id,))
+
+def refresh_user_directory(company_id):
+    """Call after creating, renaming or deleting users (no-op without sharding)."""
+    if not TENANT_SHARDING:
+        return
+    conn = get_db(company_id)
+    sync_user_directory(conn.cursor(), company_id)
+    conn.commit()
+    conn.close()
+
 def init_db():
     if os.path.exists(DATABASE):
         return
-    conn = get_db()
+    conn = get_control_db()
     c = conn.cursor()
 
     # Companies (multi-entreprises)
@@ -274,7 +925,7 @@ def init_db():
     company_id = c.lastrowid
 
     # Admin déjà activé pour cette entreprise
-    admin_pw = generate_password_hash("admin")
+    admin_pw = hash_password("admin")
     c.execute("""
         INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -282,7 +933,7 @@ def init_db():
 
 
     # Patron (owner) de démo pour cette entreprise
-    owner_pw = generate_password_hash("patron")
+    owner_pw = hash_password("patron")
     c.execute("""
         INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -290,14 +941,14 @@ def init_db():
 
     # Quelques utilisateurs de démo (tech / client) dans la même entreprise
     for i in range(1, 3):
-        demo_pw = generate_password_hash("password")
+        demo_pw = hash_password("password")
         c.execute("""
             INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (f"tech{i}", demo_pw, "tech", company_id, now, now, 0))
 
     for i in range(1, 3):
-        demo_pw = generate_password_hash("password")
+        demo_pw = hash_password("password")
         c.execute("""
             INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated)
             VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -307,10 +958,128 @@ def init_db():
     conn.close()
 
 
-def migrate_db():
-    """Add new columns/tables safely when upgrading."""
-    conn = get_db()
-    c = conn.cursor()
+# Comma-separated usernames of an intervention's assignees (sorted for stable exports).
+TECHNICIAN_NAME_SQL = """
+    SELECT COALESCE(group_concat(username, ', '), '')
+    FROM (
+        SELECT u.username
+        FROM intervention_assignees ia
+        JOIN {users} u ON u.id = ia.user_id
+        WHERE ia.intervention_id = {iid}
+        ORDER BY u.username
+    )
+"""
+
+# Tables that live in the company shards when TENANT_SHARDING is on (copy order).
+TENANT_TABLES = ("customers", "equipments", "contracts", "interventions", "intervention_files", "intervention_assignees")
+
+
+def migrate_control_db(c):
+    """Companies / users / licensing side of the schema."""
+    # login_attempts table
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            ip TEXT,
+            fail_count INTEGER DEFAULT 0,
+            last_fail_at TEXT,
+            locked_until TEXT
+        )
+    """)
+
+    # login_attempts: one row per (username, ip) holding a sliding-window counter
+    c.execute("PRAGMA table_info(login_attempts)")
+    la_cols = {row[1] for row in c.fetchall()}
+    if "window_start" not in la_cols:
+        c.execute("ALTER TABLE login_attempts ADD COLUMN window_start TEXT")
+    if "prev_count" not in la_cols:
+        c.execute("ALTER TABLE login_attempts ADD COLUMN prev_count INTEGER DEFAULT 0")
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_login_attempts_user_ip'")
+    if c.fetchone() is None:
+        # Legacy append-only rows: keep only the latest one per (username, ip).
+        c.execute("""
+            DELETE FROM login_attempts
+            WHERE id NOT IN (SELECT MAX(id) FROM login_attempts GROUP BY username, ip)
+        """)
+        c.execute("CREATE UNIQUE INDEX ux_login_attempts_user_ip ON login_attempts(username, ip)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_login_attempts_last_fail ON login_attempts(last_fail_at)")
+
+    # users.auth_version: bumped whenever role/activation/credentials change,
+    # invalidating the identity claims cached in signed sessions.
+    c.execute("PRAGMA table_info(users)")
+    if "auth_version" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE users ADD COLUMN auth_version INTEGER NOT NULL DEFAULT 0")
+
+    # lookup data version: bumped when the employees of a company change (see lookup_cache)
+    # or its name/settings do (shown in every page footer, see conditional_page)
+    create_data_version_triggers(c, "users", "UPDATE OF username, role, company_id")
+    create_data_version_triggers(c, "companies", company_column="id")
+
+
+def create_data_version_triggers(c, table, update_event="UPDATE", company_column="company_id"):
+    """Bump company_data_versions.version on every write to `table` for the row's company."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS company_data_versions (
+            company_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    for event, op, row in (("INSERT", "insert", "NEW"), (update_event, "update", "NEW"), ("DELETE", "delete", "OLD")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_data_version_{table}_{op}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO company_data_versions (company_id, version) VALUES ({row}.{company_column}, 1)
+                ON CONFLICT(company_id) DO UPDATE SET version = version + 1;
+            END
+        """)
+
+def migrate_tenant_db(c, users_table="users"):
+    """Interventions side of the schema.
+
+    `users_table` is the table the technician_name triggers read usernames from:
+    `users` in the single database, the `directory_users` mirror in a shard.
+    """
+    if users_table != "users":
+        c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {users_table} (
+                id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL
+            )
+        """)
+
+    # customers / interventions (created by init_db in the single database)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT,
+            phone TEXT,
+            address TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS interventions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER NOT NULL,
+            customer_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            client_name TEXT,
+            technician_name TEXT,
+            status TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            kind TEXT,
+            category TEXT,
+            scheduled_date TEXT,
+            created_at TEXT NOT NULL,
+            created_by INTEGER,
+            FOREIGN KEY(customer_id) REFERENCES customers(id)
+        )
+    """)
 
     # intervention_files table
     c.execute("""
@@ -329,6 +1098,17 @@ def migrate_db():
     """)
 
 
+    c.execute("PRAGMA table_info(intervention_files)")
+    if_cols = {row[1] for row in c.fetchall()}
+    if "sha256" not in if_cols:
+        c.execute("ALTER TABLE intervention_files ADD COLUMN sha256 TEXT")
+    if "size_bytes" not in if_cols:
+        c.execute("ALTER TABLE intervention_files ADD COLUMN size_bytes INTEGER")
+
+    # serve_upload() authorization lookups
+    c.execute("CREATE INDEX IF NOT EXISTS ix_intervention_files_company_sha ON intervention_files(company_id, sha256)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_intervention_files_company_path ON intervention_files(company_id, filepath)")
+
     # intervention_assignees table (multi-salariés)
     c.execute("""
         CREATE TABLE IF NOT EXISTS intervention_assignees (
@@ -339,19 +1119,6 @@ def migrate_db():
         )
     """)
 
-    # login_attempts table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS login_attempts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            ip TEXT,
-            fail_count INTEGER DEFAULT 0,
-            last_fail_at TEXT,
-            locked_until TEXT
-        )
-    """)
-
-
     # equipments table
     c.execute("""
         CREATE TABLE IF NOT EXISTS equipments (
@@ -401,9 +1168,168 @@ def migrate_db():
     add_col("tech_updated_at", "ALTER TABLE interventions ADD COLUMN tech_updated_at TEXT")
     add_col("client_signature_path", "ALTER TABLE interventions ADD COLUMN client_signature_path TEXT")
     add_col("client_signed_at", "ALTER TABLE interventions ADD COLUMN client_signed_at TEXT")
+    add_col("client_signature_vector", "ALTER TABLE interventions ADD COLUMN client_signature_vector TEXT")
     add_col("equipment_id", "ALTER TABLE interventions ADD COLUMN equipment_id INTEGER")
     add_col("contract_id", "ALTER TABLE interventions ADD COLUMN contract_id INTEGER")
 
+    # normalized names for typeahead prefix search (/api/lookup/*), written with the name
+    for table in ("customers", "equipments", "contracts"):
+        c.execute(f"PRAGMA table_info({table})")
+        if "name_norm" not in {row[1] for row in c.fetchall()}:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN name_norm TEXT")
+        c.execute(f"SELECT id, name FROM {table} WHERE name_norm IS NULL")
+        c.executemany(f"UPDATE {table} SET name_norm = ? WHERE id = ?",
+                      [(normalize_name(row[1]), row[0]) for row in c.fetchall()])
+        c.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_company_name_norm ON {table}(company_id, name_norm)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_customers_company_created ON customers(company_id, created_at)")
+    for table in ("customers", "equipments", "contracts"):
+        create_data_version_triggers(c, table)
+
+    # technician_name is a denormalized copy of the assignees (used by exports),
+    # kept in sync by triggers on the pivot so every writer stays consistent.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='trg_assignees_ai'")
+    backfill_technician_name = c.fetchone() is None
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_assignees_ai
+        AFTER INSERT ON intervention_assignees
+        BEGIN
+            UPDATE interventions
+            SET technician_name = (""" + TECHNICIAN_NAME_SQL.format(users=users_table, iid="NEW.intervention_id") + """)
+            WHERE id = NEW.intervention_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_assignees_ad
+        AFTER DELETE ON intervention_assignees
+        BEGIN
+            UPDATE interventions
+            SET technician_name = (""" + TECHNICIAN_NAME_SQL.format(users=users_table, iid="OLD.intervention_id") + """)
+            WHERE id = OLD.intervention_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_username_au
+        AFTER UPDATE OF username ON """ + users_table + """
+        BEGIN
+            UPDATE interventions
+            SET technician_name = (""" + TECHNICIAN_NAME_SQL.format(users=users_table, iid="interventions.id") + """)
+            WHERE id IN (SELECT intervention_id FROM intervention_assignees WHERE user_id = NEW.id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_ad
+        AFTER DELETE ON """ + users_table + """
+        BEGIN
+            DELETE FROM intervention_assignees WHERE user_id = OLD.id;
+        END
+    """)
+    if backfill_technician_name:
+        c.execute("""
+            UPDATE interventions
+            SET technician_name = (""" + TECHNICIAN_NAME_SQL.format(users=users_table, iid="interventions.id") + """)
+            WHERE id IN (SELECT intervention_id FROM intervention_assignees)
+        """)
+
+    # change_log: one row per write on interventions / assignees / files, read by /api/changes.
+    # AUTOINCREMENT keeps seq increasing even after compaction deleted the newest rows.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER NOT NULL,
+            entity TEXT NOT NULL,           -- intervention, assignee, file
+            entity_id INTEGER NOT NULL,     -- assignee rows use the intervention id
+            intervention_id INTEGER NOT NULL,
+            user_id INTEGER,                -- assignee rows only
+            op TEXT NOT NULL,               -- insert, update, delete
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+            old_status TEXT                 -- intervention updates that changed the status
+        )
+    """)
+    c.execute("PRAGMA table_info(change_log)")
+    if "old_status" not in [r[1] for r in c.fetchall()]:
+        c.execute("ALTER TABLE change_log ADD COLUMN old_status TEXT")
+        c.execute("DROP TRIGGER IF EXISTS trg_change_log_interventions_update")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS change_log_floor (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    """)
+    c.execute("INSERT OR IGNORE INTO change_log_floor (id, seq) VALUES (1, 0)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_change_log_company_seq ON change_log(company_id, seq)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_interventions_company_completed ON interventions(company_id, completed_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_interventions_equipment_created ON interventions(equipment_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_interventions_contract_status ON interventions(contract_id, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_contracts_company_active ON contracts(company_id, is_active)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_intervention_assignees_user ON intervention_assignees(user_id)")
+    for table, entity, id_col, iid_col, user_col in (
+        ("interventions", "intervention", "id", "id", "NULL"),
+        ("intervention_files", "file", "id", "intervention_id", "NULL"),
+        ("intervention_assignees", "assignee", "intervention_id", "intervention_id", "{row}.user_id"),
+    ):
+        for event, op, row in (("INSERT", "insert", "NEW"), ("UPDATE", "update", "NEW"), ("DELETE", "delete", "OLD")):
+            if table == "intervention_assignees" and event == "UPDATE":
+                continue
+            old_status = "NULL"
+            if table == "interventions" and event == "UPDATE":
+                old_status = "CASE WHEN OLD.status IS NOT NEW.status THEN OLD.status END"
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_change_log_{table}_{op}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (company_id, entity, entity_id, intervention_id, user_id, op, old_status)
+                    VALUES ({row}.company_id, '{entity}', {row}.{id_col}, {row}.{iid_col}, {user_col.format(row=row)}, '{op}',
+                            {old_status});
+                END
+            """)
+
+    # Daily rollup for historical charts (/api/stats/daily), maintained by refresh_daily_stats().
+    # daily_stats_contrib keeps the days each intervention counts on, so an update knows
+    # which days it leaves as well as which it lands on.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats_contrib (
+            intervention_id INTEGER PRIMARY KEY,
+            company_id INTEGER NOT NULL,
+            created_day TEXT NOT NULL,
+            closed_day TEXT,
+            late_day TEXT,                  -- first day the intervention is overdue, if before closed_day
+            time_spent_minutes INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_daily_stats_contrib_created ON daily_stats_contrib(company_id, created_day)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_daily_stats_contrib_closed ON daily_stats_contrib(company_id, closed_day)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_daily_stats_contrib_late ON daily_stats_contrib(company_id, late_day)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_company_stats (
+            company_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            created_count INTEGER NOT NULL DEFAULT 0,
+            closed_count INTEGER NOT NULL DEFAULT 0,
+            late_delta INTEGER NOT NULL DEFAULT 0,
+            time_spent_closed_minutes INTEGER NOT NULL DEFAULT 0,
+            backlog INTEGER NOT NULL DEFAULT 0,     -- open at the end of the day
+            late_count INTEGER NOT NULL DEFAULT 0,  -- open and past scheduled_date at the end of the day
+            PRIMARY KEY (company_id, day)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL,
+            refreshed_at TEXT NOT NULL
+        )
+    """)
+
+
+def migrate_db():
+    """Add new columns/tables safely when upgrading."""
+    conn = get_control_db()
+    # WAL lets the read-only connections run while a writer holds the lock.
+    conn.execute("PRAGMA journal_mode = WAL")
+    c = conn.cursor()
+    migrate_control_db(c)
+    if not TENANT_SHARDING:
+        migrate_tenant_db(c)
     conn.commit()
     conn.close()
 
@@ -418,7 +1344,7 @@ def ensure_admin_credentials():
         print("[MaintControl] ADMIN_PASSWORD too short (min 12). Ignored.")
         return
 
-    conn = get_db()
+    conn = get_control_db()
     c = conn.cursor()
     c.execute("SELECT * FROM users WHERE role='admin' ORDER BY id LIMIT 1")
     u = c.fetchone()
@@ -433,13 +1359,14 @@ def ensure_admin_credentials():
         c.execute("""
             INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated)
             VALUES (?, ?, 'admin', ?, ?, ?, 1)
-        """, (username, generate_password_hash(pw), company_id, now, now))
+        """, (username, hash_password(pw), company_id, now, now))
     else:
         username = admin_user or u["username"]
-        pw_hash = generate_password_hash(admin_pass) if admin_pass else u["password"]
-        c.execute("UPDATE users SET username=?, password=? WHERE id=?", (username, pw_hash, u["id"]))
+        pw_hash = hash_password(admin_pass) if admin_pass else u["password"]
+        c.execute("UPDATE users SET username=?, password=?, auth_version = auth_version + 1 WHERE id=?", (username, pw_hash, u["id"]))
     conn.commit()
     conn.close()
+    refresh_user_directory(u["company_id"] if u else company_id)
 
 
 # Init DB at import (Flask 3 compatible)
@@ -449,27 +1376,85 @@ ensure_admin_credentials()
 
 # ---------- helpers ----------
 
+# Identity claims cached in the signed session cookie; routes read them like a users row.
+SESSION_CLAIMS = ("id", "username", "role", "company_id", "is_activated", "trial_start", "auth_version")
+
+def _claims_from_row(row):
+    claims = {k: row[k] for k in SESSION_CLAIMS}
+    claims["checked_at"] = datetime.utcnow().timestamp()
+    return claims
+
+def login_user(row):
+    session["user_id"] = row["id"]
+    session["auth"] = _claims_from_row(row)
+
+def bump_auth_version(c, user_id):
+    """Invalidate the session claims of `user_id` (call after changing role/activation/credentials)."""
+    c.execute("UPDATE users SET auth_version = auth_version + 1 WHERE id = ?", (user_id,))
+
+def refresh_current_user():
+    """Drop cached claims so the next get_current_user() reloads them from the database."""
+    session.pop("auth", None)
+    g.pop("current_user", None)
+
 def get_current_user():
+    """Return the current user's claims as a dict, or None.
+
+    Read-only requests trust the signed session claims (no DB read) for up to
+    AUTH_CLAIMS_MAX_AGE_SECONDS; write requests always compare auth_version.
+    """
+    if "current_user" in g:
+        return g.current_user
     uid = session.get("user_id")
     if not uid:
         return None
-    conn = get_db()
+    claims = session.get("auth")
+    if claims and claims.get("id") == uid:
+        fresh = datetime.utcnow().timestamp() - claims.get("checked_at", 0) < AUTH_CLAIMS_MAX_AGE_SECONDS
+        if fresh and request.method in ("GET", "HEAD", "OPTIONS"):
+            g.current_user = claims
+            return claims
+        conn = get_control_read_db()
+        c = conn.cursor()
+        c.execute("SELECT auth_version FROM users WHERE id = ?", (uid,))
+        row = c.fetchone()
+        conn.close()
+        if row and row["auth_version"] == claims.get("auth_version"):
+            claims = dict(claims, checked_at=datetime.utcnow().timestamp())
+            session["auth"] = claims
+            g.current_user = claims
+            return claims
+        if not row:
+            session.clear()
+            g.current_user = None
+            return None
+    conn = get_control_read_db()
     c = conn.cursor()
     c.execute("SELECT * FROM users WHERE id = ?", (uid,))
     row = c.fetchone()
     conn.close()
-    return row
+    if not row:
+        session.clear()
+        g.current_user = None
+        return None
+    session["auth"] = claims = _claims_from_row(row)
+    g.current_user = claims
+    return claims
 
 def get_current_company(user=None):
     if user is None:
         user = get_current_user()
     if not user:
         return None
-    conn = get_db()
+    cached = g.get("current_company")
+    if cached is not None and cached["id"] == user["company_id"]:
+        return g.current_company
+    conn = get_control_read_db()
     c = conn.cursor()
     c.execute("SELECT * FROM companies WHERE id = ?", (user["company_id"],))
     company = c.fetchone()
     conn.close()
+    g.current_company = company
     return company
 
 def is_trial_expired(user):
@@ -496,7 +1481,7 @@ def require_login(f):
     from functools import wraps
     @wraps(f)
     def wrapper(*args, **kwargs):
-        if not session.get("user_id"):
+        if not get_current_user():
             return redirect(url_for("login"))
         return f(*args, **kwargs)
     return wrapper
@@ -518,6 +1503,91 @@ def require_roles(*roles):
         return wrapper
     return deco
 
+def _page_etag_build():
+    """Changes on deploy: static fingerprints and template modification times."""
+    h = hashlib.sha1(repr(sorted(STATIC_MANIFEST.items())).encode("utf-8"))
+    for root, _dirs, files in os.walk(app.template_folder):
+        for name in sorted(files):
+            if name.endswith(".html"):
+                h.update(f"{name}:{os.path.getmtime(os.path.join(root, name))}".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+PAGE_ETAG_BUILD = _page_etag_build()
+
+def page_etag():
+    """ETag of the current GET page, or None when the page must always be rendered.
+
+    Built from the company data version, the user's claims (role, activation), the
+    endpoint and its filters, the language and the deploy, so it needs no page query.
+    """
+    if request.method not in ("GET", "HEAD") or app.debug or "_flashes" in session:
+        return None
+    version = request_data_version()
+    if version is None:
+        return None
+    user = get_current_user()
+    key = (PAGE_ETAG_BUILD, request.endpoint, request.query_string, session.get("lang", DEFAULT_LANG),
+           tuple(user[k] for k in SESSION_CLAIMS), version, time_window())
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+
+def conditional_page(f):
+    """Decorator: answer 304 when If-None-Match matches page_etag(), before the view runs."""
+    from functools import wraps
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        etag = page_etag()
+        if etag and request.if_none_match.contains_weak(etag):
+            resp = app.response_class(status=304)
+        else:
+            resp = app.make_response(f(*args, **kwargs))
+            if not etag or resp.status_code != 200:
+                return resp
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    return wrapper
+
+def normalize_name(value):
+    """Search key for name columns: accents stripped, case folded, spaces collapsed."""
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return " ".join(value.casefold().split())
+
+def parse_id_list(values):
+    """Parse a list of form values into a de-duplicated list of ints (invalid values are skipped)."""
+    ids = []
+    for v in values:
+        try:
+            i = int(v)
+        except (TypeError, ValueError):
+            continue
+        if i not in ids:
+            ids.append(i)
+    return ids
+
+def sync_assignees(c, intervention_id, company_id, current_ids, wanted_ids):
+    """Apply the difference between current and wanted assignees to the pivot table.
+
+    Only users of `company_id` can be added. `technician_name` is refreshed by the
+    pivot triggers, so callers must not write it themselves.
+    """
+    current, wanted = set(current_ids), set(wanted_ids)
+    removed = current - wanted
+    added = wanted - current
+    if removed:
+        c.executemany(
+            "DELETE FROM intervention_assignees WHERE intervention_id = ? AND user_id = ? AND company_id = ?",
+            [(intervention_id, uid, company_id) for uid in sorted(removed)],
+        )
+    if added:
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO intervention_assignees (intervention_id, user_id, company_id)
+            SELECT ?, id, company_id FROM users WHERE id = ? AND company_id = ?
+            """,
+            [(intervention_id, uid, company_id) for uid in sorted(added)],
+        )
+
 @app.context_processor
 def inject_globals():
     user = get_current_user()
@@ -529,6 +1599,7 @@ def inject_globals():
         "is_trial_expired": is_trial_expired(user) if user else False,
         "lang": lang,
         "supported_langs": SUPPORTED_LANGS,
+        "t": lambda key: translate(key, lang),
     }
 
 # ---------- routes auth / langue ----------
@@ -547,19 +1618,66 @@ def set_lang(lang_code):
     return redirect(request.referrer or url_for("dashboard"))
 
 
+# ---------- Login rate limiting ----------
+
+_last_login_purge = 0.0
+
+def _client_ip():
+    # remote_addr is the proxy-reported address only when ProxyFix trusts it (TRUSTED_PROXY_HOPS):
+    # the left-most X-Forwarded-For entries are set by the client and must not be used.
+    return request.remote_addr or "unknown"
+
+def _failure_estimate(la, now):
+    """Sliding-window estimate of recent failures for a login_attempts row.
+
+    The row keeps the count of the current fixed window and of the previous one;
+    the previous window is weighted by how much of it still overlaps the sliding window.
+    Returns (estimate, window_start, fail_count, prev_count) with windows rolled to `now`.
+    """
+    window = timedelta(seconds=LOGIN_WINDOW_SECONDS)
+    if not la or not la["window_start"]:
+        return 0.0, now, 0, 0
+    try:
+        start = datetime.fromisoformat(la["window_start"])
+    except ValueError:
+        return 0.0, now, 0, 0
+    count, prev = int(la["fail_count"] or 0), int(la["prev_count"] or 0)
+    if now - start >= 2 * window:
+        start, count, prev = now, 0, 0
+    elif now - start >= window:
+        start, count, prev = start + window, 0, count
+    elapsed = (now - start).total_seconds() / LOGIN_WINDOW_SECONDS
+    return prev * (1 - elapsed) + count, start, count, prev
+
+def purge_login_attempts(c, now):
+    """Drop rows whose lockout and counting windows are both over."""
+    cutoff = (now - timedelta(seconds=2 * LOGIN_WINDOW_SECONDS)).isoformat()
+    c.execute("""
+        DELETE FROM login_attempts
+        WHERE last_fail_at < ?
+          AND (locked_until IS NULL OR locked_until < ?)
+    """, (cutoff, now.isoformat()))
+
+def _maybe_purge_login_attempts(c, now):
+    global _last_login_purge
+    ts = now.timestamp()
+    if ts - _last_login_purge >= LOGIN_PURGE_INTERVAL_SECONDS:
+        _last_login_purge = ts
+        purge_login_attempts(c, now)
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr) or "unknown"
+        ip = _client_ip()
         now = datetime.utcnow()
 
-        conn = get_db()
+        conn = get_control_db()
         c = conn.cursor()
 
-        # Lockout check
-        c.execute("SELECT * FROM login_attempts WHERE username=? AND ip=? ORDER BY id DESC LIMIT 1", (username, ip))
+        # Lockout check (unique index on username, ip)
+        c.execute("SELECT * FROM login_attempts WHERE username=? AND ip=?", (username, ip))
         la = c.fetchone()
         if la and la["locked_until"]:
             try:
@@ -576,29 +1694,34 @@ def login():
 
         ok = bool(user and check_password_hash(user["password"], password))
         if ok:
-            c.execute("INSERT INTO login_attempts (username, ip, fail_count, last_fail_at, locked_until) VALUES (?, ?, 0, ?, NULL)",
-                      (username, ip, now.isoformat()))
+            if password_needs_rehash(user["password"]):
+                c.execute("UPDATE users SET password=? WHERE id=?", (hash_password(password), user["id"]))
+            if la:
+                c.execute("DELETE FROM login_attempts WHERE username=? AND ip=?", (username, ip))
+            _maybe_purge_login_attempts(c, now)
             conn.commit()
             conn.close()
-            session["user_id"] = user["id"]
+            login_user(user)
             return redirect(url_for("dashboard"))
 
         # failure update
-        fail_count = 1
-        if la and la["fail_count"] is not None and la["last_fail_at"]:
-            try:
-                last = datetime.fromisoformat(la["last_fail_at"])
-                if (now - last).total_seconds() <= 600:
-                    fail_count = int(la["fail_count"]) + 1
-            except Exception:
-                pass
-
+        estimate, window_start, fail_count, prev_count = _failure_estimate(la, now)
+        fail_count += 1
         locked_until = None
-        if fail_count >= 5:
-            locked_until = (now + timedelta(minutes=15)).isoformat()
+        if estimate + 1 >= LOGIN_MAX_FAILURES:
+            locked_until = (now + timedelta(minutes=LOGIN_LOCKOUT_MINUTES)).isoformat()
 
-        c.execute("INSERT INTO login_attempts (username, ip, fail_count, last_fail_at, locked_until) VALUES (?, ?, ?, ?, ?)",
-                  (username, ip, fail_count, now.isoformat(), locked_until))
+        c.execute("""
+            INSERT INTO login_attempts (username, ip, fail_count, prev_count, window_start, last_fail_at, locked_until)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(username, ip) DO UPDATE SET
+                fail_count = excluded.fail_count,
+                prev_count = excluded.prev_count,
+                window_start = excluded.window_start,
+                last_fail_at = excluded.last_fail_at,
+                locked_until = excluded.locked_until
+        """, (username, ip, fail_count, prev_count, window_start.isoformat(), now.isoformat(), locked_until))
+        _maybe_purge_login_attempts(c, now)
         conn.commit()
         conn.close()
         flash("Identifiants invalides", "error")
@@ -613,15 +1736,10 @@ def logout():
 
 # ---------- Dashboard ----------
 
-@app.route("/dashboard")
-@require_login
-def dashboard():
-    user = get_current_user()
-    company = get_current_company(user)
-    conn = get_db()
+def dashboard_recent(user, company_id):
+    """Latest interventions shown on the dashboard."""
+    conn = get_read_db()
     c = conn.cursor()
-
-    # Latest interventions shown on dashboard
     if user["role"] in ("tech", "employee"):
         c.execute("""
             SELECT i.*
@@ -630,36 +1748,40 @@ def dashboard():
             WHERE i.company_id = ? AND ia.user_id = ?
             ORDER BY i.created_at DESC
             LIMIT 10
-        """, (company["id"], user["id"]))
-        interventions = c.fetchall()
+        """, (company_id, user["id"]))
     elif user["role"] == "client":
         c.execute("""
             SELECT * FROM interventions
             WHERE company_id = ? AND client_name = ?
             ORDER BY created_at DESC
             LIMIT 10
-        """, (company["id"], user["id"]))
-        interventions = c.fetchall()
+        """, (company_id, user["id"]))
     else:
         c.execute("""
             SELECT * FROM interventions
             WHERE company_id = ?
             ORDER BY created_at DESC
             LIMIT 10
-        """, (company["id"],))
-        interventions = c.fetchall()
+        """, (company_id,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def dashboard_kpis(user, company_id):
+    conn = get_read_db()
+    c = conn.cursor()
 
-    # KPI
     def count_where(extra=""):
         q = "SELECT COUNT(*) AS n FROM interventions WHERE company_id = ? " + extra
-        cp = [company["id"]]
-        c.execute(q, tuple(cp))
+        c.execute(q, (company_id,))
         return c.fetchone()["n"]
 
-    total = count_where("")
-    open_count = count_where("AND status = 'open'")
-    in_progress = count_where("AND status = 'in_progress'")
-    done_count = count_where("AND status = 'done'")
+    kpi = {
+        "total": count_where(""),
+        "open": count_where("AND status = 'open'"),
+        "in_progress": count_where("AND status = 'in_progress'"),
+        "done": count_where("AND status = 'done'"),
+    }
 
     now_iso = datetime.utcnow().isoformat()
     c.execute("""
@@ -670,42 +1792,48 @@ def dashboard():
           AND scheduled_date != ''
           AND scheduled_date < ?
           AND status != 'done'
-    """, (company["id"], now_iso))
-    late_count = c.fetchone()["n"]
+    """, (company_id, now_iso))
+    kpi["late"] = c.fetchone()["n"]
 
     if user["role"] == "tech":
         c.execute("""
             SELECT COUNT(*) AS n
             FROM interventions
             WHERE company_id = ? AND technician_name = ? AND status != 'done'
-        """, (company["id"], user["id"]))
-        my_open = c.fetchone()["n"]
+        """, (company_id, user["id"]))
+        kpi["mine"] = c.fetchone()["n"]
     elif user["role"] == "client":
         c.execute("""
             SELECT COUNT(*) AS n
             FROM interventions
             WHERE company_id = ? AND client_name = ? AND status != 'done'
-        """, (company["id"], user["id"]))
-        my_open = c.fetchone()["n"]
+        """, (company_id, user["id"]))
+        kpi["mine"] = c.fetchone()["n"]
     else:
-        my_open = open_count
-
+        kpi["mine"] = kpi["open"]
     conn.close()
+    return kpi
 
-    suggestions = suggest_priorities([dict(row) for row in interventions])
-    trial_left = remaining_trial_days(user)
+def dashboard_context(user, company_id):
+    """Template data of the dashboard regions, queried only if a fragment is rendered."""
+    recent = LazyResult(lambda: dashboard_recent(user, company_id))
+    return {
+        "interventions": recent,
+        "suggestions": LazyResult(lambda: suggest_priorities([dict(row) for row in recent])),
+        "kpi": LazyResult(lambda: dashboard_kpis(user, company_id)),
+        "time_window": time_window(),
+    }
 
+@app.route("/dashboard")
+@require_login
+@conditional_page
+def dashboard():
+    user = get_current_user()
+    company = get_current_company(user)
     return render_template(
         "dashboard.html",
-        interventions=interventions,
-        suggestions=suggestions,
-        trial_left=trial_left,
-        total_interventions=total,
-        open_count=open_count,
-        in_progress=in_progress,
-        done_count=done_count,
-        late_count=late_count,
-        my_open=my_open,
+        trial_left=remaining_trial_days(user),
+        **dashboard_context(user, company["id"]),
     )
 
 # ---------- Customers (clients réels) ----------
@@ -729,29 +1857,133 @@ def customers():
             conn = get_db()
             c = conn.cursor()
             c.execute("""
-                INSERT INTO customers (company_id, name, email, phone, address, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (company["id"], name, email, phone, address, datetime.utcnow().isoformat()))
+                INSERT INTO customers (company_id, name, name_norm, email, phone, address, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (company["id"], name, normalize_name(name), email, phone, address, datetime.utcnow().isoformat()))
             conn.commit()
             conn.close()
             flash("Client créé.", "success")
 
-    conn = get_db()
+    q = normalize_name(request.args.get("q"))
+    before = request.args.get("before") or ""
+    query = "SELECT * FROM customers WHERE company_id = ?"
+    params = [company["id"]]
+    if q:
+        query += " AND name_norm >= ? AND name_norm < ?"
+        params += [q, q + LOOKUP_PREFIX_END]
+    created_at, _, last_id = before.rpartition("~")
+    if created_at and last_id.isdigit():
+        query += " AND (created_at, id) < (?, ?)"
+        params += [created_at, int(last_id)]
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(CUSTOMERS_PAGE_SIZE + 1)
+
+    conn = get_read_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM customers WHERE company_id = ? ORDER BY created_at DESC", (company["id"],))
+    c.execute(query, params)
     customers = c.fetchall()
     conn.close()
-    return render_template("customers.html", customers=customers)
+    next_cursor = None
+    if len(customers) > CUSTOMERS_PAGE_SIZE:
+        customers = customers[:CUSTOMERS_PAGE_SIZE]
+        next_cursor = f"{customers[-1]['created_at']}~{customers[-1]['id']}"
+    return render_template("customers.html", customers=customers, next_cursor=next_cursor)
+
+# ---------- Recherche (typeahead) ----------
+
+LOOKUP_LIMIT = 20
+LOOKUP_PREFIX_END = "\U0010ffff"  # upper bound of a prefix range on name_norm
+LOOKUP_TABLES = {"customers": "customers", "equipments": "equipments", "contracts": "contracts"}
+
+def company_lookup_version(c, company_id):
+    """Version of the company's customers, users, equipments and contracts.
+
+    company_data_versions is bumped by triggers on those tables. With TENANT_SHARDING
+    users live in the control database, which keeps its own counter.
+    """
+    if TENANT_SHARDING:
+        c.execute("""
+            SELECT (SELECT version FROM main.company_data_versions WHERE company_id = ?),
+                   (SELECT version FROM control.company_data_versions WHERE company_id = ?)
+        """, (company_id, company_id))
+        return tuple(c.fetchone())
+    c.execute("SELECT version FROM company_data_versions WHERE company_id = ?", (company_id,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+def form_employees(c, company_id):
+    """Users offered as assignees in the intervention form."""
+    def load():
+        c.execute("SELECT id, username, role FROM users WHERE company_id = ? AND role IN ('tech','employee','manager') ORDER BY username",
+                  (company_id,))
+        return [dict(r) for r in c.fetchall()]
+    return lookup_cache.get_or_compute(("employees", company_id), company_lookup_version(c, company_id), load)
+
+def lookup_labels(c, company_id, customer=None, equipment=None, contract=None):
+    """Names of the records preselected in a form's pickers, served from lookup_cache."""
+    labels = {}
+    version = None
+    for key, table, value in (("customer", "customers", customer), ("equipment", "equipments", equipment),
+                              ("contract", "contracts", contract)):
+        try:
+            record_id = int(value) if value not in (None, "") else None
+        except (TypeError, ValueError):
+            record_id = None
+        if record_id is None:
+            continue
+        if version is None:
+            version = company_lookup_version(c, company_id)
+
+        def load(table=table, record_id=record_id):
+            c.execute(f"SELECT name FROM {table} WHERE id = ? AND company_id = ?", (record_id, company_id))
+            row = c.fetchone()
+            return row["name"] if row else None
+
+        label = lookup_cache.get_or_compute((table, company_id, record_id), version, load)
+        if label is not None:
+            labels[key] = {"id": record_id, "label": label}
+    return labels
+
+@app.route("/api/lookup/<kind>")
+@require_login
+def api_lookup(kind):
+    """Prefix search on the normalized name: ?q=&customer_id=, at most LOOKUP_LIMIT rows."""
+    table = LOOKUP_TABLES.get(kind)
+    if table is None:
+        return jsonify({"error": "unknown lookup"}), 404
+    user = get_current_user()
+    company = get_current_company(user)
+    q = normalize_name(request.args.get("q"))
+    query = f"SELECT id, name, {'NULL' if table == 'customers' else 'customer_id'} AS customer_id FROM {table} WHERE company_id = ?"
+    params = [company["id"]]
+    if q:
+        query += " AND name_norm >= ? AND name_norm < ?"
+        params += [q, q + LOOKUP_PREFIX_END]
+    customer_id = request.args.get("customer_id", type=int)
+    if customer_id and table != "customers":
+        query += " AND customer_id = ?"
+        params.append(customer_id)
+    query += " ORDER BY name_norm LIMIT ?"
+    params.append(LOOKUP_LIMIT)
+    conn = get_read_db()
+    c = conn.cursor()
+    c.execute(query, params)
+    results = [{"id": r["id"], "label": r["name"], "customer_id": r["customer_id"]} for r in c.fetchall()]
+    conn.close()
+    resp = jsonify({"results": results})
+    resp.headers["Cache-Control"] = "private, max-age=30"
+    return resp
 
 
 # ---------- Équipements ----------
 
 @app.route("/equipments")
 @require_login
+@conditional_page
 def equipments():
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     c.execute("""
         SELECT e.*, cu.name AS customer_name
@@ -761,10 +1993,8 @@ def equipments():
         ORDER BY e.created_at DESC
     """, (company["id"],))
     items = c.fetchall()
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     conn.close()
-    return render_template("equipments.html", equipments=items, customers=customers)
+    return render_template("equipments.html", equipments=items)
 
 @app.route("/equipments/new", methods=["GET","POST"])
 @require_login
@@ -772,10 +2002,8 @@ def equipments():
 def new_equipment():
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     if request.method == "POST":
         name = (request.form.get("name") or "").strip()
         customer_id = request.form.get("customer_id") or None
@@ -789,15 +2017,16 @@ def new_equipment():
         else:
             cid = int(customer_id) if customer_id and str(customer_id).isdigit() else None
             c.execute("""
-                INSERT INTO equipments (company_id, customer_id, name, reference, serial_number, location, notes, next_preventive_date, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (company["id"], cid, name, reference, serial_number, location, notes, next_prev, datetime.utcnow().isoformat()))
+                INSERT INTO equipments (company_id, customer_id, name, name_norm, reference, serial_number, location, notes, next_preventive_date, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (company["id"], cid, name, normalize_name(name), reference, serial_number, location, notes, next_prev, datetime.utcnow().isoformat()))
             conn.commit()
             conn.close()
             flash("Équipement créé.", "success")
             return redirect(url_for("equipments"))
+    labels = lookup_labels(c, company["id"], customer=request.form.get("customer_id"))
     conn.close()
-    return render_template("equipment_form.html", equipment=None, customers=customers)
+    return render_template("equipment_form.html", equipment=None, labels=labels)
 
 @app.route("/equipments/<int:equipment_id>/edit", methods=["GET","POST"])
 @require_login
@@ -805,15 +2034,13 @@ def new_equipment():
 def edit_equipment(equipment_id):
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
     c.execute("SELECT * FROM equipments WHERE id=? AND company_id=?", (equipment_id, company["id"]))
     equipment = c.fetchone()
     if not equipment:
         conn.close()
         return "Not found", 404
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     if request.method == "POST":
         action = request.form.get("action","save")
         if action == "delete":
@@ -835,24 +2062,113 @@ def edit_equipment(equipment_id):
             cid = int(customer_id) if customer_id and str(customer_id).isdigit() else None
             c.execute("""
                 UPDATE equipments
-                SET customer_id=?, name=?, reference=?, serial_number=?, location=?, notes=?, next_preventive_date=?
+                SET customer_id=?, name=?, name_norm=?, reference=?, serial_number=?, location=?, notes=?, next_preventive_date=?
                 WHERE id=? AND company_id=?
-            """, (cid, name, reference, serial_number, location, notes, next_prev, equipment_id, company["id"]))
+            """, (cid, name, normalize_name(name), reference, serial_number, location, notes, next_prev, equipment_id, company["id"]))
             conn.commit()
             conn.close()
             flash("Équipement mis à jour.", "success")
             return redirect(url_for("equipments"))
+    labels = lookup_labels(c, company["id"], customer=request.form.get("customer_id", equipment["customer_id"]))
     conn.close()
-    return render_template("equipment_form.html", equipment=equipment, customers=customers)
+    return render_template("equipment_form.html", equipment=equipment, labels=labels)
+
+def equipment_summary(c, company_id, equipment_id):
+    c.execute(f"""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM({analytics_ops.corrective_sql(alias=None)}), 0) AS corrective_count,
+               COALESCE(SUM(status != 'done'), 0) AS open_count,
+               COALESCE(SUM(time_spent_minutes), 0) AS total_minutes,
+               MAX(COALESCE(completed_at, started_at)) AS last_visit_at
+        FROM interventions
+        WHERE equipment_id = ? AND company_id = ?
+    """, (equipment_id, company_id))
+    return dict(c.fetchone())
+
+def equipment_history(c, company_id, equipment_id, before=None, limit=EQUIPMENT_HISTORY_PAGE_SIZE):
+    """One page of an equipment's interventions, newest first.
+
+    Keyset pagination on ix_interventions_equipment_created: `before` is the cursor
+    returned with the previous page ("<created_at>~<id>"). Returns (rows, next_cursor).
+    """
+    query = """
+        SELECT id, title, status, priority, kind, technician_name, scheduled_date,
+               created_at, started_at, completed_at, time_spent_minutes
+        FROM interventions
+        WHERE equipment_id = ? AND company_id = ?
+    """
+    params = [equipment_id, company_id]
+    if before:
+        created_at, _, last_id = before.rpartition("~")
+        if created_at and last_id.isdigit():
+            query += " AND (created_at, id) < (?, ?)"
+            params += [created_at, int(last_id)]
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    c.execute(query, params)
+    rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['created_at']}~{rows[-1]['id']}"
+    return rows, next_cursor
+
+def _history_limit():
+    limit = request.args.get("limit", EQUIPMENT_HISTORY_PAGE_SIZE, type=int)
+    return max(1, min(limit, EQUIPMENT_HISTORY_MAX_PAGE_SIZE))
+
+@app.route("/equipments/<int:equipment_id>")
+@require_login
+def equipment_detail(equipment_id):
+    user = get_current_user()
+    company = get_current_company(user)
+    conn = get_read_db()
+    c = conn.cursor()
+    c.execute("""
+        SELECT e.*, cu.name AS customer_name
+        FROM equipments e
+        LEFT JOIN customers cu ON e.customer_id = cu.id
+        WHERE e.id = ? AND e.company_id = ?
+    """, (equipment_id, company["id"]))
+    equipment = c.fetchone()
+    if not equipment:
+        conn.close()
+        return "Not found", 404
+    summary = equipment_summary(c, company["id"], equipment_id)
+    history, next_cursor = equipment_history(c, company["id"], equipment_id, request.args.get("before"), _history_limit())
+    conn.close()
+    return render_template("equipment_detail.html", equipment=equipment, summary=summary,
+                           history=history, next_cursor=next_cursor)
+
+@app.route("/api/equipments/<int:equipment_id>/interventions")
+@require_login
+def api_equipment_interventions(equipment_id):
+    """History page as JSON; the summary is only computed for the first page."""
+    user = get_current_user()
+    company = get_current_company(user)
+    conn = get_read_db()
+    c = conn.cursor()
+    c.execute("SELECT id FROM equipments WHERE id = ? AND company_id = ?", (equipment_id, company["id"]))
+    if not c.fetchone():
+        conn.close()
+        return jsonify({"error": "not found"}), 404
+    before = request.args.get("before")
+    history, next_cursor = equipment_history(c, company["id"], equipment_id, before, _history_limit())
+    payload = {"interventions": [dict(r) for r in history], "next": next_cursor}
+    if not before:
+        payload["summary"] = equipment_summary(c, company["id"], equipment_id)
+    conn.close()
+    return jsonify(payload)
 
 # ---------- Contrats ----------
 
 @app.route("/contracts")
 @require_login
+@conditional_page
 def contracts():
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     c.execute("""
         SELECT ct.*, cu.name AS customer_name
@@ -862,10 +2178,82 @@ def contracts():
         ORDER BY ct.created_at DESC
     """, (company["id"],))
     items = c.fetchall()
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     conn.close()
-    return render_template("contracts.html", contracts=items, customers=customers)
+    return render_template("contracts.html", contracts=items)
+
+CONTRACT_COMPLIANCE_SQL = """
+    SELECT id, name, customer_name, start_date, end_date, visits_per_year,
+           visits_done, last_visit, expected_to_date,
+           MAX(expected_to_date - visits_done, 0) AS overdue_visits,
+           CASE WHEN visits_per_year > 0
+                THEN date(period_start, '+' || CAST(ROUND((visits_done + 1) * 365.25 / visits_per_year) AS INTEGER) || ' days')
+           END AS next_due_date
+    FROM (
+        SELECT ct.id, ct.name, cu.name AS customer_name, ct.start_date, ct.end_date,
+               COALESCE(ct.visits_per_year, 0) AS visits_per_year,
+               date(COALESCE(NULLIF(ct.start_date, ''), ct.created_at)) AS period_start,
+               COUNT(i.id) AS visits_done,
+               MAX(date(COALESCE(i.completed_at, i.scheduled_date, i.created_at))) AS last_visit,
+               CAST(COALESCE(ct.visits_per_year, 0)
+                    * MAX(julianday(MIN(date(:today), COALESCE(NULLIF(ct.end_date, ''), '9999-12-31')))
+                          - julianday(date(COALESCE(NULLIF(ct.start_date, ''), ct.created_at))), 0)
+                    / 365.25 AS INTEGER) AS expected_to_date
+        FROM contracts ct
+        LEFT JOIN customers cu ON cu.id = ct.customer_id
+        LEFT JOIN interventions i
+               ON i.contract_id = ct.id AND i.company_id = ct.company_id AND i.status = 'done'
+              AND date(COALESCE(i.completed_at, i.scheduled_date, i.created_at))
+                  BETWEEN date(COALESCE(NULLIF(ct.start_date, ''), ct.created_at))
+                      AND COALESCE(date(NULLIF(ct.end_date, '')), '9999-12-31')
+        WHERE ct.company_id = :company_id AND ct.is_active = 1
+        GROUP BY ct.id
+    )
+    ORDER BY overdue_visits DESC, next_due_date
+"""
+
+def contract_compliance(c, company_id):
+    """Expected vs done visits of every active contract, in a single grouped query.
+
+    Visits are done interventions linked to the contract and dated (completed_at, else
+    scheduled_date, else created_at) inside the contract period. Expected visits
+    accrue pro rata from start_date up to today or end_date; visit n+1 is due
+    n+1 intervals (a year / visits_per_year) after start_date once n visits are done.
+    """
+    today = datetime.utcnow().date().isoformat()
+    version = (company_data_version(c, company_id), company_lookup_version(c, company_id), today)
+
+    def compute():
+        c.execute(CONTRACT_COMPLIANCE_SQL, {"company_id": company_id, "today": today})
+        rows = []
+        for r in c.fetchall():
+            row = dict(r)
+            row["late"] = bool(row["overdue_visits"]) or bool(row["next_due_date"] and row["next_due_date"] < today)
+            rows.append(row)
+        return rows
+
+    return analytics_cache.get_or_compute(("contract_compliance", company_id), version, compute)
+
+@app.route("/contracts/compliance")
+@require_login
+@require_roles("admin","owner","manager")
+def contracts_compliance():
+    user = get_current_user()
+    company = get_current_company(user)
+    conn = get_read_db()
+    rows = contract_compliance(conn.cursor(), company["id"])
+    conn.close()
+    return render_template("contracts_compliance.html", rows=rows)
+
+@app.route("/api/contracts/compliance")
+@require_login
+@require_roles("admin","owner","manager")
+def api_contracts_compliance():
+    user = get_current_user()
+    company = get_current_company(user)
+    conn = get_read_db()
+    rows = contract_compliance(conn.cursor(), company["id"])
+    conn.close()
+    return jsonify({"contracts": rows})
 
 @app.route("/contracts/new", methods=["GET","POST"])
 @require_login
@@ -873,10 +2261,8 @@ def contracts():
 def new_contract():
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     if request.method == "POST":
         name = (request.form.get("name") or "").strip()
         customer_id = request.form.get("customer_id") or ""
@@ -889,15 +2275,16 @@ def new_contract():
             flash("Nom et client du contrat sont obligatoires.", "error")
         else:
             c.execute("""
-                INSERT INTO contracts (company_id, customer_id, name, start_date, end_date, visits_per_year, is_active, notes, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (company["id"], int(customer_id), name, start_date, end_date, int(visits), is_active, notes, datetime.utcnow().isoformat()))
+                INSERT INTO contracts (company_id, customer_id, name, name_norm, start_date, end_date, visits_per_year, is_active, notes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (company["id"], int(customer_id), name, normalize_name(name), start_date, end_date, int(visits), is_active, notes, datetime.utcnow().isoformat()))
             conn.commit()
             conn.close()
             flash("Contrat créé.", "success")
             return redirect(url_for("contracts"))
+    labels = lookup_labels(c, company["id"], customer=request.form.get("customer_id"))
     conn.close()
-    return render_template("contract_form.html", contract=None, customers=customers)
+    return render_template("contract_form.html", contract=None, labels=labels)
 
 @app.route("/contracts/<int:contract_id>/edit", methods=["GET","POST"])
 @require_login
@@ -905,15 +2292,13 @@ def new_contract():
 def edit_contract(contract_id):
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
     c.execute("SELECT * FROM contracts WHERE id=? AND company_id=?", (contract_id, company["id"]))
     contract = c.fetchone()
     if not contract:
         conn.close()
         return "Not found", 404
-    c.execute("SELECT * FROM customers WHERE company_id=? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
     if request.method == "POST":
         action = request.form.get("action","save")
         if action == "delete":
@@ -934,31 +2319,27 @@ def edit_contract(contract_id):
         else:
             c.execute("""
                 UPDATE contracts
-                SET customer_id=?, name=?, start_date=?, end_date=?, visits_per_year=?, is_active=?, notes=?
+                SET customer_id=?, name=?, name_norm=?, start_date=?, end_date=?, visits_per_year=?, is_active=?, notes=?
                 WHERE id=? AND company_id=?
-            """, (int(customer_id), name, start_date, end_date, int(visits), is_active, notes, contract_id, company["id"]))
+            """, (int(customer_id), name, normalize_name(name), start_date, end_date, int(visits), is_active, notes, contract_id, company["id"]))
             conn.commit()
             conn.close()
             flash("Contrat mis à jour.", "success")
             return redirect(url_for("contracts"))
+    labels = lookup_labels(c, company["id"], customer=request.form.get("customer_id", contract["customer_id"]))
     conn.close()
-    return render_template("contract_form.html", contract=contract, customers=customers)
+    return render_template("contract_form.html", contract=contract, labels=labels)
 
 
 # ---------- Interventions ----------
 
-@app.route("/interventions")
-@require_login
-def list_interventions():
-    user = get_current_user()
-    company = get_current_company(user)
-    if user["role"] in ("tech","employee"):
-        return redirect(url_for("tech_interventions"))
-    conn = get_db()
+def intervention_list_rows(user, company_id, args):
+    """Interventions list with the status / priority / kind / category filters of `args`."""
+    conn = get_read_db()
     c = conn.cursor()
 
     base_query = "SELECT i.*, cu.name AS customer_name, e.name AS equipment_name, ct.name AS contract_name FROM interventions i LEFT JOIN customers cu ON i.customer_id = cu.id LEFT JOIN equipments e ON i.equipment_id = e.id LEFT JOIN contracts ct ON i.contract_id = ct.id WHERE i.company_id = ?"
-    params = [company["id"]]
+    params = [company_id]
 
     if user["role"] == "tech":
         base_query += " AND i.technician_name = ?"
@@ -967,10 +2348,10 @@ def list_interventions():
         base_query += " AND i.client_name = ?"
         params.append(user["username"])
 
-    status = request.args.get("status", "").strip()
-    priority = request.args.get("priority", "").strip()
-    kind = request.args.get("kind", "").strip()
-    category = request.args.get("category", "").strip()
+    status = args.get("status", "").strip()
+    priority = args.get("priority", "").strip()
+    kind = args.get("kind", "").strip()
+    category = args.get("category", "").strip()
 
     if status:
         base_query += " AND i.status = ?"
@@ -989,12 +2370,19 @@ def list_interventions():
     c.execute(base_query, tuple(params))
     interventions = c.fetchall()
 
-    # customers for filter info maybe
-    c.execute("SELECT * FROM customers WHERE company_id = ? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
-
     conn.close()
-    return render_template("interventions.html", interventions=interventions, customers=customers)
+    return interventions
+
+@app.route("/interventions")
+@require_login
+@conditional_page
+def list_interventions():
+    user = get_current_user()
+    company = get_current_company(user)
+    if user["role"] in ("tech","employee"):
+        return redirect(url_for("tech_interventions"))
+    interventions = LazyResult(lambda: intervention_list_rows(user, company["id"], request.args))
+    return render_template("interventions.html", interventions=interventions)
 
 @app.route("/interventions/new", methods=["GET", "POST"])
 @require_login
@@ -1004,16 +2392,9 @@ def new_intervention():
     if user["role"] not in ("admin","owner","manager"):
         return "Forbidden", 403
 
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM customers WHERE company_id = ? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
-    c.execute("SELECT id, username, role FROM users WHERE company_id = ? AND role IN ('tech','employee','manager') ORDER BY username", (company["id"],))
-    employees = c.fetchall()
-    c.execute("SELECT id, name, customer_id FROM equipments WHERE company_id=? ORDER BY name", (company["id"],))
-    equipments = c.fetchall()
-    c.execute("SELECT id, name, customer_id, is_active FROM contracts WHERE company_id=? ORDER BY created_at DESC", (company["id"],))
-    contracts = c.fetchall()
+    employees = form_employees(c, company["id"])
 
     if request.method == "POST":
         title = request.form.get("title")
@@ -1029,13 +2410,7 @@ def new_intervention():
         contract_id = request.form.get("contract_id") or None
 
         # multi-assignees
-        assignee_ids = request.form.getlist("assignees")
-        assignee_ids_int = []
-        for v in assignee_ids:
-            try:
-                assignee_ids_int.append(int(v))
-            except Exception:
-                pass
+        assignee_ids_int = parse_id_list(request.form.getlist("assignees"))
 
         # if customer selected, auto-fill client_name with customer name
         if customer_id:
@@ -1063,48 +2438,26 @@ def new_intervention():
         except Exception:
             contract_id = None
 
-        # resolve usernames for display/exports (kept for backward compat)
-        # cast optional FK ids
-        try:
-            equipment_id = int(equipment_id) if equipment_id else None
-        except Exception:
-            equipment_id = None
-        try:
-            contract_id = int(contract_id) if contract_id else None
-        except Exception:
-            contract_id = None
-
-
-        technician_name = ""
-        if assignee_ids_int:
-            qmarks = ",".join(["?"] * len(assignee_ids_int))
-            c.execute(f"SELECT id, username FROM users WHERE company_id = ? AND id IN ({qmarks})", tuple([company["id"]] + assignee_ids_int))
-            rows = c.fetchall()
-            id_to_name = {r["id"]: r["username"] for r in rows}
-            technician_name = ", ".join([id_to_name.get(i) for i in assignee_ids_int if id_to_name.get(i)])
-
+        # technician_name is filled by the intervention_assignees triggers.
         c.execute("""
             INSERT INTO interventions
             (company_id, customer_id, equipment_id, contract_id, title, description, client_name, technician_name, status, priority, kind, category, scheduled_date, created_at, created_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (company["id"], customer_id, equipment_id, contract_id, title, description, client_name, technician_name, status, priority, kind, category, scheduled_date, datetime.utcnow().isoformat(), user["id"]))
+            VALUES (?, ?, ?, ?, ?, ?, ?, '', ?, ?, ?, ?, ?, ?, ?)
+        """, (company["id"], customer_id, equipment_id, contract_id, title, description, client_name, status, priority, kind, category, scheduled_date, datetime.utcnow().isoformat(), user["id"]))
 
         intervention_id = c.lastrowid
 
         # save pivot rows
-        c.execute("DELETE FROM intervention_assignees WHERE intervention_id = ? AND company_id = ?", (intervention_id, company["id"]))
-        for uid in assignee_ids_int:
-            c.execute(
-                "INSERT OR IGNORE INTO intervention_assignees (intervention_id, user_id, company_id) VALUES (?, ?, ?)",
-                (intervention_id, uid, company["id"])
-            )
+        sync_assignees(c, intervention_id, company["id"], [], assignee_ids_int)
 
         conn.commit()
         conn.close()
         return redirect(url_for("list_interventions"))
 
+    labels = lookup_labels(c, company["id"], customer=request.form.get("customer_id"),
+                           equipment=request.form.get("equipment_id"), contract=request.form.get("contract_id"))
     conn.close()
-    return render_template("intervention_form.html", intervention=None, customers=customers, employees=employees, equipments=equipments, contracts=contracts, selected_assignees=[])
+    return render_template("intervention_form.html", intervention=None, employees=employees, labels=labels, selected_assignees=[])
 
 @app.route("/interventions/<int:intervention_id>/edit", methods=["GET", "POST"])
 @require_login
@@ -1114,7 +2467,7 @@ def edit_intervention(intervention_id):
     if user["role"] not in ("admin","owner","manager"):
         return "Forbidden", 403
 
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
     c.execute("SELECT * FROM interventions WHERE id=? AND company_id=?", (intervention_id, company["id"]))
     intervention = c.fetchone()
@@ -1123,14 +2476,7 @@ def edit_intervention(intervention_id):
         flash("Intervention introuvable.", "error")
         return redirect(url_for("list_interventions"))
 
-    c.execute("SELECT * FROM customers WHERE company_id = ? ORDER BY name", (company["id"],))
-    customers = c.fetchall()
-    c.execute("SELECT id, username, role FROM users WHERE company_id = ? AND role IN ('tech','employee','manager') ORDER BY username", (company["id"],))
-    employees = c.fetchall()
-    c.execute("SELECT id, name, customer_id FROM equipments WHERE company_id=? ORDER BY name", (company["id"],))
-    equipments = c.fetchall()
-    c.execute("SELECT id, name, customer_id, is_active FROM contracts WHERE company_id=? ORDER BY created_at DESC", (company["id"],))
-    contracts = c.fetchall()
+    employees = form_employees(c, company["id"])
     c.execute("SELECT user_id FROM intervention_assignees WHERE intervention_id = ? AND company_id = ?", (intervention_id, company["id"]))
     selected_assignees = [r["user_id"] for r in c.fetchall()]
 
@@ -1157,13 +2503,7 @@ def edit_intervention(intervention_id):
         equipment_id = request.form.get("equipment_id") or None
         contract_id = request.form.get("contract_id") or None
 
-        assignee_ids = request.form.getlist("assignees")
-        assignee_ids_int = []
-        for v in assignee_ids:
-            try:
-                assignee_ids_int.append(int(v))
-            except Exception:
-                pass
+        assignee_ids_int = parse_id_list(request.form.getlist("assignees"))
 
         if customer_id:
             try:
@@ -1189,35 +2529,27 @@ def edit_intervention(intervention_id):
         except Exception:
             contract_id = None
 
-
-        technician_name = ""
-        if assignee_ids_int:
-            qmarks = ",".join(["?"] * len(assignee_ids_int))
-            c.execute(f"SELECT id, username FROM users WHERE company_id = ? AND id IN ({qmarks})", tuple([company["id"]] + assignee_ids_int))
-            rows = c.fetchall()
-            id_to_name = {r["id"]: r["username"] for r in rows}
-            technician_name = ", ".join([id_to_name.get(i) for i in assignee_ids_int if id_to_name.get(i)])
-
         c.execute("""
             UPDATE interventions
-            SET customer_id=?, equipment_id=?, contract_id=?, title=?, description=?, client_name=?, technician_name=?, status=?, priority=?, kind=?, category=?, scheduled_date=?
+            SET customer_id=?, equipment_id=?, contract_id=?, title=?, description=?, client_name=?, status=?, priority=?, kind=?, category=?, scheduled_date=?
             WHERE id=? AND company_id=?
-        """, (customer_id, equipment_id, contract_id, title, description, client_name, technician_name, status, priority, kind, category, scheduled_date, intervention_id, company["id"]))
+        """, (customer_id, equipment_id, contract_id, title, description, client_name, status, priority, kind, category, scheduled_date, intervention_id, company["id"]))
 
-        c.execute("DELETE FROM intervention_assignees WHERE intervention_id = ? AND company_id = ?", (intervention_id, company["id"]))
-        for uid in assignee_ids_int:
-            c.execute(
-                "INSERT OR IGNORE INTO intervention_assignees (intervention_id, user_id, company_id) VALUES (?, ?, ?)",
-                (intervention_id, uid, company["id"])
-            )
+        sync_assignees(c, intervention_id, company["id"], selected_assignees, assignee_ids_int)
 
         conn.commit()
         conn.close()
         flash("Intervention mise à jour.", "success")
         return redirect(url_for("list_interventions"))
 
+    labels = lookup_labels(c, company["id"], customer=intervention["customer_id"],
+                           equipment=intervention["equipment_id"], contract=intervention["contract_id"])
+    c.execute("SELECT * FROM intervention_files WHERE intervention_id=? AND company_id=? ORDER BY uploaded_at DESC",
+              (intervention_id, company["id"]))
+    files = c.fetchall()
     conn.close()
-    return render_template("intervention_form.html", intervention=intervention, customers=customers, employees=employees, equipments=equipments, contracts=contracts, selected_assignees=selected_assignees)
+    return render_template("intervention_form.html", intervention=intervention, employees=employees, labels=labels,
+                           selected_assignees=selected_assignees, files=files)
 
 @app.route("/tech/interventions")
 @require_login
@@ -1227,7 +2559,7 @@ def tech_interventions():
         return redirect(url_for("dashboard"))
     company = get_current_company(user)
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     c.execute("""
         SELECT i.* FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id = i.id WHERE i.company_id = ? AND ia.user_id = ? ORDER BY
@@ -1240,6 +2572,76 @@ def tech_interventions():
     conn.close()
     return render_template("tech_interventions.html", interventions=items)
 
+TECH_SYNC_MAX_MUTATIONS = 200
+
+def apply_tech_update(c, it, fields, now):
+    """Apply a technician's status / notes / time entry to intervention row `it`.
+
+    Only keys present in `fields` are changed. Returns the new tech_updated_at.
+    """
+    status = (fields.get("status") or it["status"] or "open").strip()
+    note = it["tech_notes"]
+    if "tech_notes" in fields:
+        note = (fields.get("tech_notes") or "").strip()
+    mins = fields.get("time_spent_minutes")
+    if mins is None or mins == "":
+        mins = it["time_spent_minutes"] or 0
+    try:
+        mins = int(mins)
+    except (TypeError, ValueError, OverflowError):
+        mins = int(it["time_spent_minutes"] or 0)
+
+    started_at = it["started_at"]
+    completed_at = it["completed_at"]
+    if status == "in_progress" and not started_at:
+        started_at = now
+    if status == "done" and not completed_at:
+        completed_at = now
+
+    c.execute("""
+        UPDATE interventions
+        SET status=?, tech_notes=?, time_spent_minutes=?, started_at=?, completed_at=?, tech_updated_at=?
+        WHERE id=?
+    """, (status, note, mins, started_at, completed_at, now, it["id"]))
+    return now
+
+TECH_STATUSES = ("open", "in_progress", "done")
+TECH_MAX_MINUTES = 100000
+
+def valid_tech_fields(fields):
+    """Type check of an offline update's fields (JSON may carry numbers, lists, Infinity...)."""
+    status = fields.get("status")
+    if status is not None and not (isinstance(status, str) and status.strip() in TECH_STATUSES + ("",)):
+        return False
+    notes = fields.get("tech_notes")
+    if notes is not None and not isinstance(notes, str):
+        return False
+    mins = fields.get("time_spent_minutes")
+    if mins is None or mins == "":
+        return True
+    if isinstance(mins, bool) or not isinstance(mins, (int, str)):
+        return False
+    try:
+        return 0 <= int(mins) <= TECH_MAX_MINUTES
+    except ValueError:
+        return False
+
+def _tech_update_landed(it, fields):
+    keys = [k for k in ("status", "tech_notes", "time_spent_minutes") if k in fields]
+    if not keys:
+        return False
+    return all(str(it[k] if it[k] is not None else "") == str(fields[k] if fields[k] is not None else "").strip()
+               for k in keys)
+
+def _tech_sync_state(it):
+    return {
+        "status": it["status"],
+        "tech_notes": it["tech_notes"],
+        "time_spent_minutes": it["time_spent_minutes"],
+        "tech_updated_at": it["tech_updated_at"],
+        "client_signed_at": it["client_signed_at"],
+    }
+
 @app.route("/tech/interventions/<int:intervention_id>", methods=["GET", "POST"])
 @require_login
 def tech_intervention_detail(intervention_id):
@@ -1248,7 +2650,7 @@ def tech_intervention_detail(intervention_id):
         return redirect(url_for("dashboard"))
     company = get_current_company(user)
 
-    conn = get_db()
+    conn = get_request_db()
     c = conn.cursor()
     c.execute("SELECT i.* FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id=i.id WHERE i.id=? AND i.company_id=? AND ia.user_id=?", (intervention_id, company["id"], user["id"]))
     it = c.fetchone()
@@ -1263,27 +2665,11 @@ def tech_intervention_detail(intervention_id):
     files = c.fetchall()
 
     if request.method == "POST":
-        status = (request.form.get("status") or it["status"]).strip()
-        note = (request.form.get("tech_notes") or "").strip()
-        try:
-            mins = int(request.form.get("time_spent_minutes") or (it["time_spent_minutes"] or 0))
-        except Exception:
-            mins = int(it["time_spent_minutes"] or 0)
-
-        now = datetime.utcnow().isoformat()
-        started_at = it["started_at"]
-        completed_at = it["completed_at"]
-
-        if status == "in_progress" and not started_at:
-            started_at = now
-        if status == "done" and not completed_at:
-            completed_at = now
-
-        c.execute("""
-            UPDATE interventions
-            SET status=?, tech_notes=?, time_spent_minutes=?, started_at=?, completed_at=?, tech_updated_at=?
-            WHERE id=?
-        """, (status, note, mins, started_at, completed_at, now, intervention_id))
+        apply_tech_update(c, it, {
+            "status": request.form.get("status"),
+            "tech_notes": request.form.get("tech_notes") or "",
+            "time_spent_minutes": request.form.get("time_spent_minutes"),
+        }, datetime.utcnow().isoformat())
         conn.commit()
         conn.close()
         flash("Mise à jour enregistrée.", "success")
@@ -1314,25 +2700,148 @@ def tech_upload_proof(intervention_id):
         conn.close()
         return "Forbidden", 403
 
-    safe_name = f"{company['id']}_{intervention_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(4)}_{os.path.basename(f.filename)}"
-    path = os.path.join(_uploads_dir(), safe_name)
-    f.save(path)
+    path, digest, size = store_upload(f)
 
     c.execute("""
-        INSERT INTO intervention_files (intervention_id, company_id, filename, filepath, uploaded_by, uploaded_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (intervention_id, company["id"], os.path.basename(f.filename), path, user["id"], datetime.utcnow().isoformat()))
+        INSERT INTO intervention_files (intervention_id, company_id, filename, filepath, sha256, size_bytes, uploaded_by, uploaded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (intervention_id, company["id"], os.path.basename(f.filename), path, digest, size, user["id"], datetime.utcnow().isoformat()))
     conn.commit()
     conn.close()
+    schedule_thumbnails(path, f.filename)
     flash("Preuve ajoutée.", "success")
     return redirect(url_for("tech_intervention_detail", intervention_id=intervention_id))
 
+# Uploads shown in the page; anything else (HTML, SVG, PDF...) is downloaded, never
+# rendered on the app's origin.
+INLINE_UPLOAD_MIMETYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
 @app.route("/uploads/<path:filename>")
 @require_login
 def serve_upload(filename):
-    # Basic protection: only logged in users can access; further checks can be added
-    from flask import send_from_directory
-    return send_from_directory(_uploads_dir(), filename)
+    user = get_current_user()
+    company = get_current_company(user)
+    path = safe_join(_uploads_dir(), filename)
+    if path is None or not os.path.isfile(path):
+        return "Not found", 404
+
+    # The file must belong to the caller's company (content-addressed blobs are
+    # looked up by hash, legacy flat files by path; both are indexed).
+    digest = os.path.basename(path)
+    conn = get_read_db()
+    c = conn.cursor()
+    if re.fullmatch(r"[0-9a-f]{64}", digest) and path == upload_path_for(digest):
+        c.execute("SELECT filename, sha256 FROM intervention_files WHERE company_id = ? AND sha256 = ? LIMIT 1",
+                  (company["id"], digest))
+    else:
+        c.execute("SELECT filename, sha256 FROM intervention_files WHERE company_id = ? AND filepath = ? LIMIT 1",
+                  (company["id"], path))
+    row = c.fetchone()
+    if row is None:
+        c.execute("SELECT 1 FROM interventions WHERE company_id = ? AND client_signature_path = ? LIMIT 1",
+                  (company["id"], path))
+        if c.fetchone() is None:
+            conn.close()
+            return "Not found", 404
+    conn.close()
+
+    download_name = row["filename"] if row else os.path.basename(path)
+    mimetype = mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    immutable = bool(row and row["sha256"] and row["sha256"] == digest)
+
+    # Thumbnail variants, generated on demand when the background job has not run yet.
+    size = request.args.get("size")
+    if size in THUMBNAIL_SIZES and is_thumbnailable(download_name):
+        fmt = "webp" if "image/webp" in request.accept_mimetypes else "jpg"
+        variant = thumbnail_path(path, size, fmt)
+        if os.path.exists(variant) or generate_thumbnails(path, [size], [fmt]):
+            path, mimetype = variant, THUMBNAIL_FORMATS[fmt][1]
+            download_name = f"{os.path.splitext(download_name)[0]}_{size}.{fmt}"
+            digest = f"{digest}-{size}-{fmt}" if immutable else digest
+
+    if UPLOAD_SERVE_MODE in ("x-accel", "x-sendfile"):
+        resp = app.response_class(mimetype=mimetype)
+        if UPLOAD_SERVE_MODE == "x-accel":
+            rel = os.path.relpath(path, _uploads_dir()).replace(os.sep, "/")
+            resp.headers["X-Accel-Redirect"] = UPLOAD_ACCEL_PREFIX.rstrip("/") + "/" + rel
+        else:
+            resp.headers["X-Sendfile"] = path
+    else:
+        resp = send_file(path, mimetype=mimetype, download_name=download_name, conditional=True,
+                         etag=digest if immutable else True)
+    if size:
+        resp.vary.add("Accept")
+    disposition = "inline" if mimetype in INLINE_UPLOAD_MIMETYPES else "attachment"
+    resp.headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    resp.headers["Cache-Control"] = "private, max-age=31536000, immutable" if immutable else "private, max-age=3600"
+    return resp
+
+# ---------- Signatures (stroke vectors) ----------
+
+SIGNATURE_MAX_STROKES = 200
+SIGNATURE_MAX_POINTS = 5000
+
+def parse_signature_strokes(raw):
+    """Validate the signature pad payload and return its compact JSON form, or None.
+
+    Expected: {"w": int, "h": int, "strokes": [[x0, y0, x1, y1, ...], ...]} in canvas pixels.
+    """
+    try:
+        data = json.loads(raw)
+        w, h = int(data["w"]), int(data["h"])
+        strokes = data["strokes"]
+    except (ValueError, TypeError, KeyError, OverflowError):  # json.loads accepts Infinity / NaN
+        return None
+    if not (0 < w <= 4000 and 0 < h <= 4000) or not isinstance(strokes, list):
+        return None
+    clean, total = [], 0
+    for stroke in strokes[:SIGNATURE_MAX_STROKES]:
+        if not isinstance(stroke, list) or len(stroke) < 2 or len(stroke) % 2:
+            continue
+        try:
+            pts = [min(max(int(round(float(v))), 0), lim) for v, lim in zip(stroke, [w, h] * (len(stroke) // 2))]
+        except (TypeError, ValueError, OverflowError):
+            return None
+        total += len(pts) // 2
+        if total > SIGNATURE_MAX_POINTS:
+            break
+        clean.append(pts)
+    if not clean:
+        return None
+    return json.dumps({"w": w, "h": h, "strokes": clean}, separators=(",", ":"))
+
+def draw_signature_vector(p, vector_json, x, y, box_w, box_h):
+    """Draw stored strokes as vector paths into a reportlab canvas box (x, y = bottom-left)."""
+    sig = json.loads(vector_json)
+    scale = min(box_w / sig["w"], box_h / sig["h"])
+    top = y + sig["h"] * scale
+    p.setLineWidth(1.2)
+    p.setLineCap(1)
+    p.setLineJoin(1)
+    path = p.beginPath()
+    for stroke in sig["strokes"]:
+        path.moveTo(x + stroke[0] * scale, top - stroke[1] * scale)
+        if len(stroke) == 2:
+            path.lineTo(x + stroke[0] * scale + 0.1, top - stroke[1] * scale)
+        for i in range(2, len(stroke), 2):
+            path.lineTo(x + stroke[i] * scale, top - stroke[i + 1] * scale)
+    p.drawPath(path, stroke=1, fill=0)
+
+def render_signature_png(vector_json, line_width=3):
+    sig = json.loads(vector_json)
+    from PIL import ImageDraw
+    img = Image.new("RGBA", (sig["w"], sig["h"]), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    for stroke in sig["strokes"]:
+        pts = list(zip(stroke[0::2], stroke[1::2]))
+        if len(pts) == 1:
+            pts = pts * 2
+        draw.line(pts, fill=(0, 0, 0, 255), width=line_width, joint="curve")
+    mem = io.BytesIO()
+    img.save(mem, "PNG", optimize=True)
+    mem.seek(0)
+    return mem
 
 @app.route("/tech/interventions/<int:intervention_id>/sign", methods=["POST"])
 @require_login
@@ -1341,20 +2850,12 @@ def tech_save_signature(intervention_id):
     if user["role"] not in ("tech","employee"):
         return "Forbidden", 403
     company = get_current_company(user)
-    sig = (request.form.get("signature_data") or "").strip()
+    vector = parse_signature_strokes(request.form.get("signature_strokes") or "")
 
-    if not sig.startswith("data:image/png;base64,"):
+    if not vector:
         flash("Signature invalide.", "error")
         return redirect(url_for("tech_intervention_detail", intervention_id=intervention_id))
 
-    b64 = sig.split(",", 1)[1]
-    data = base64.b64decode(b64)
-
-    fname = f"sig_{company['id']}_{intervention_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.png"
-    fpath = os.path.join(_uploads_dir(), fname)
-    with open(fpath, "wb") as fp:
-        fp.write(data)
-
     conn = get_db()
     c = conn.cursor()
     c.execute("SELECT i.* FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id=i.id WHERE i.id=? AND i.company_id=? AND ia.user_id=?", (intervention_id, company["id"], user["id"]))
@@ -1364,13 +2865,118 @@ def tech_save_signature(intervention_id):
         return "Forbidden", 403
 
     now = datetime.utcnow().isoformat()
-    c.execute("UPDATE interventions SET client_signature_path=?, client_signed_at=? WHERE id=?",
-              (fpath, now, intervention_id))
+    c.execute("UPDATE interventions SET client_signature_vector=?, client_signature_path=NULL, client_signed_at=?, tech_updated_at=? WHERE id=?",
+              (vector, now, now, intervention_id))
     conn.commit()
     conn.close()
     flash("Signature enregistrée.", "success")
     return redirect(url_for("tech_intervention_detail", intervention_id=intervention_id))
 
+@app.route("/api/tech/sync", methods=["POST"])
+@require_login
+def tech_sync():
+    """Apply a queue of offline technician mutations in a single transaction.
+
+    Body: {"mutations": [{"id": "<client id>", "intervention_id": 12, "type": "update" | "signature",
+    "base_updated_at": "<tech_updated_at seen by the client>", "fields": {...}}]}.
+    A mutation whose base no longer matches the row is reported as a conflict with the
+    server state; the others are applied. Results come back in request order.
+    """
+    user = get_current_user()
+    if user["role"] not in ("tech","employee"):
+        return jsonify({"error": "forbidden"}), 403
+    company = get_current_company(user)
+    payload = request.get_json(silent=True)
+    mutations = payload.get("mutations") if isinstance(payload, dict) else None
+    if not isinstance(mutations, list):
+        return jsonify({"error": "mutations must be a list"}), 400
+    if len(mutations) > TECH_SYNC_MAX_MUTATIONS:
+        return jsonify({"error": f"at most {TECH_SYNC_MAX_MUTATIONS} mutations per batch"}), 413
+
+    conn = get_db()
+    c = conn.cursor()
+    # Take the write lock before the conflict checks read tech_updated_at, so no other
+    # writer can slip in between a check and the UPDATE it guards.
+    c.execute("BEGIN IMMEDIATE")
+    results = []
+    # tech_updated_at values written by this batch: a later mutation queued against the
+    # same starting state must not conflict with one applied just before it.
+    written = {}
+    for m in mutations:
+        if not isinstance(m, dict):
+            results.append({"id": None, "status": "invalid"})
+            continue
+        res = {"id": m.get("id")}
+        results.append(res)
+        try:
+            iid = int(m.get("intervention_id"))
+        except (TypeError, ValueError, OverflowError):
+            res["status"] = "invalid"
+            continue
+        fields = m.get("fields") if isinstance(m.get("fields"), dict) else {}
+        if m.get("type") == "update" and not valid_tech_fields(fields):
+            res["status"] = "invalid"
+            continue
+        c.execute("SELECT i.* FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id=i.id WHERE i.id=? AND i.company_id=? AND ia.user_id=?",
+                  (iid, company["id"], user["id"]))
+        it = c.fetchone()
+        if not it:
+            res["status"] = "not_found"
+            continue
+
+        base = m.get("base_updated_at")
+        current = it["tech_updated_at"]
+        if base != current and current not in written.get(iid, ()):
+            if m.get("type") == "update" and _tech_update_landed(it, fields):
+                # replay of a mutation that already landed (response lost on the way back)
+                res["status"] = "applied"
+            else:
+                res["status"] = "conflict"
+            res["server"] = _tech_sync_state(it)
+            continue
+
+        now = datetime.utcnow().isoformat()
+        if m.get("type") == "update":
+            apply_tech_update(c, it, fields, now)
+        elif m.get("type") == "signature":
+            vector = parse_signature_strokes(fields.get("signature_strokes") or "")
+            if not vector:
+                res["status"] = "invalid"
+                continue
+            c.execute("UPDATE interventions SET client_signature_vector=?, client_signature_path=NULL, client_signed_at=?, tech_updated_at=? WHERE id=?",
+                      (vector, now, now, iid))
+        else:
+            res["status"] = "invalid"
+            continue
+        written.setdefault(iid, set()).add(now)
+        res["status"] = "applied"
+        res["tech_updated_at"] = now
+    conn.commit()
+    conn.close()
+    return jsonify({"results": results})
+
+@app.route("/interventions/<int:intervention_id>/signature.png")
+@require_login
+def signature_png(intervention_id):
+    """PNG rendering of a vector signature, only produced when someone asks for it."""
+    user = get_current_user()
+    company = get_current_company(user)
+    conn = get_read_db()
+    c = conn.cursor()
+    if user["role"] in ("tech", "employee"):
+        c.execute("SELECT i.client_signature_vector FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id=i.id WHERE i.id=? AND i.company_id=? AND ia.user_id=?", (intervention_id, company["id"], user["id"]))
+    elif user["role"] in ("admin", "owner", "manager"):
+        c.execute("SELECT client_signature_vector FROM interventions WHERE id=? AND company_id=?", (intervention_id, company["id"]))
+    else:
+        conn.close()
+        return "Forbidden", 403
+    row = c.fetchone()
+    conn.close()
+    if not row or not row["client_signature_vector"] or Image is None:
+        return "Not found", 404
+    return send_file(render_signature_png(row["client_signature_vector"]), mimetype="image/png",
+                     download_name=f"signature_{intervention_id}.png")
+
 @app.route("/tech/interventions/<int:intervention_id>/report.pdf")
 @require_login
 def tech_report_pdf(intervention_id):
@@ -1379,13 +2985,14 @@ def tech_report_pdf(intervention_id):
         return "Forbidden", 403
     company = get_current_company(user)
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     c.execute("SELECT i.* FROM interventions i JOIN intervention_assignees ia ON ia.intervention_id=i.id WHERE i.id=? AND i.company_id=? AND ia.user_id=?", (intervention_id, company["id"], user["id"]))
     it = c.fetchone()
     if not it:
         conn.close()
         return "Not found", 404
+    it = dict(it)
     c.execute("SELECT * FROM intervention_files WHERE intervention_id=? AND company_id=? ORDER BY uploaded_at DESC",
               (intervention_id, company["id"]))
     files = c.fetchall()
@@ -1444,15 +3051,19 @@ def tech_report_pdf(intervention_id):
                 y = height - 60
                 p.setFont("Helvetica", 10)
 
-    # Signature image if exists
+    # Signature: vector strokes (legacy PNG signatures are still embedded as images)
+    sig_vector = it.get("client_signature_vector")
     sig_path = it.get("client_signature_path")
-    if sig_path and os.path.exists(sig_path):
+    if sig_vector or (sig_path and os.path.exists(sig_path)):
         y -= 10
         p.setFont("Helvetica-Bold", 12)
         p.drawString(50, y, "Signature client")
         y -= 10
         try:
-            p.drawImage(sig_path, 50, max(40, y-140), width=220, height=120, preserveAspectRatio=True, mask='auto')
+            if sig_vector:
+                draw_signature_vector(p, sig_vector, 50, max(40, y-140), 220, 120)
+            else:
+                p.drawImage(sig_path, 50, max(40, y-140), width=220, height=120, preserveAspectRatio=True, mask='auto')
             y -= 150
         except Exception:
             pass
@@ -1476,7 +3087,7 @@ def export_csv():
     if is_trial_expired(user) and not user.get("is_activated") and user["role"] != "admin":
         return "Trial expiré - export CSV réservé aux comptes activés.", 403
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
 
     # NOTE:
@@ -1580,7 +3191,7 @@ def export_pdf():
     if is_trial_expired(user) and not user.get("is_activated") and user["role"] != "admin":
         return "Trial expiré - export PDF réservé aux comptes activés.", 403
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
 
     # See note in export_csv(): support both (client_name vs customer_id) and
@@ -1671,7 +3282,7 @@ def export_pdf():
             # If technician_name isn't set, show assignees (first 3) to avoid empty columns.
             tech_display = (row["technician_name"] or "").strip()
             if not tech_display:
-                conn2 = get_db()
+                conn2 = get_read_db()
                 c2 = conn2.cursor()
                 c2.execute(
                     """
@@ -1722,7 +3333,7 @@ def intervention_pdf(intervention_id):
     if is_trial_expired(user) and not user.get("is_activated") and user["role"] != "admin":
         return "Trial expiré - export PDF réservé aux comptes activés.", 403
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
 
     # Récupération intervention + infos liées.
@@ -1858,7 +3469,7 @@ def export_email():
         return redirect(url_for("list_interventions"))
 
     # Build same query as exports
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     base_query = "SELECT * FROM interventions WHERE company_id = ?"
     params = [company["id"]]
@@ -1944,16 +3555,12 @@ def export_advanced():
 
 # ---------- Planning ----------
 
-@app.route("/planning")
-@require_login
-def planning():
-    user = get_current_user()
-    company = get_current_company(user)
-    conn = get_db()
+def planning_buckets(user, company_id):
+    """Scheduled interventions split into today / overdue / upcoming (UTC days)."""
+    conn = get_read_db()
     c = conn.cursor()
 
     base_query = "SELECT * FROM interventions WHERE company_id = ? AND scheduled_date IS NOT NULL AND scheduled_date != ''"
-    params = [company["id"]]
 
     if user["role"] in ("tech", "employee"):
         c.execute("""
@@ -1963,37 +3570,46 @@ def planning():
             WHERE i.company_id = ?
               AND ia.user_id = ?
               AND i.scheduled_date IS NOT NULL AND i.scheduled_date != ''
-        """, (company["id"], user["id"]))
-        all_sched = c.fetchall()
+        """, (company_id, user["id"]))
     elif user["role"] == "client":
-        c.execute(base_query + " AND client_name = ?", (company["id"], user["username"]))
-        all_sched = c.fetchall()
+        c.execute(base_query + " AND client_name = ?", (company_id, user["username"]))
     else:
-        c.execute(base_query, tuple(params))
-        all_sched = c.fetchall()
-
+        c.execute(base_query, (company_id,))
+    all_sched = c.fetchall()
     conn.close()
 
     today = datetime.utcnow().date()
-    today_list, overdue, upcoming = [], [], []
+    buckets = {"today": [], "overdue": [], "upcoming": []}
     for it in all_sched:
         try:
             d = datetime.fromisoformat(it["scheduled_date"]).date()
         except Exception:
             continue
         if d == today:
-            today_list.append(it)
+            buckets["today"].append(it)
         elif d < today and it["status"] != "done":
-            overdue.append(it)
+            buckets["overdue"].append(it)
         elif d > today:
-            upcoming.append(it)
+            buckets["upcoming"].append(it)
+    return buckets
 
-    return render_template(
-        "planning.html",
-        today_list=today_list,
-        overdue=overdue,
-        upcoming=upcoming,
-    )
+def planning_context(user, company_id):
+    """Template data of the planning regions; the single query runs only if a fragment is rendered."""
+    buckets = LazyResult(lambda: planning_buckets(user, company_id))
+    return {
+        "today": datetime.utcnow().date().isoformat(),
+        "today_list": LazyResult(lambda: buckets["today"]),
+        "overdue": LazyResult(lambda: buckets["overdue"]),
+        "upcoming": LazyResult(lambda: buckets["upcoming"]),
+    }
+
+@app.route("/planning")
+@require_login
+@conditional_page
+def planning():
+    user = get_current_user()
+    company = get_current_company(user)
+    return render_template("planning.html", **planning_context(user, company["id"]))
 
 # ---------- Licences & activation ----------
 
@@ -2004,7 +3620,7 @@ def admin_licenses():
     if user["role"] != "admin":
         return "Forbidden", 403
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_control_db()
     c = conn.cursor()
 
     if request.method == "POST":
@@ -2031,7 +3647,10 @@ def admin_licenses():
                 else:
                     c.execute("UPDATE users SET is_activated = 1, license_key = ? WHERE id = ?", (key, u["id"]))
                     c.execute("UPDATE license_keys SET assigned_to = ?, used = 1 WHERE id = ?", (u["id"], k["id"]))
+                    bump_auth_version(c, u["id"])
                     conn.commit()
+                    if u["id"] == user["id"]:
+                        refresh_current_user()
                     flash("Clé assignée et utilisateur activé", "success")
 
     c.execute("SELECT * FROM license_keys WHERE company_id = ? ORDER BY created_at DESC", (company["id"],))
@@ -2048,7 +3667,7 @@ def admin_users():
     if admin["role"] not in ("admin","owner"):
         return "Forbidden", 403
     company = get_current_company(admin)
-    conn = get_db()
+    conn = get_control_db()
     c = conn.cursor()
 
     if request.method == "POST":
@@ -2080,7 +3699,7 @@ def admin_users():
                 now = datetime.utcnow().isoformat()
                 trial_start = now if start_trial else None
                 try:
-                    hashed = generate_password_hash(password)
+                    hashed = hash_password(password)
                     c.execute("""
                         INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated, license_key)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -2100,6 +3719,7 @@ def admin_users():
                         """, (key, new_user_id))
 
                     conn.commit()
+                    refresh_user_directory(company["id"])
                     flash("Utilisateur créé avec succès.", "success")
                 except sqlite3.IntegrityError:
                     flash("Nom d'utilisateur déjà utilisé.", "error")
@@ -2126,8 +3746,10 @@ def admin_users():
                 elif target["role"] == "admin":
                     flash("Vous ne pouvez pas supprimer un autre administrateur.", "error")
                 else:
+                    # Sessions of the deleted user fail their next version check.
                     c.execute("DELETE FROM users WHERE id = ? AND company_id = ?", (user_id_int, company["id"]))
                     conn.commit()
+                    refresh_user_directory(company["id"])
                     flash("Utilisateur supprimé.", "success")
 
     c.execute("""
@@ -2152,7 +3774,7 @@ def activate():
     msg = None
     if request.method == "POST":
         key = request.form.get("key")
-        conn = get_db()
+        conn = get_control_db()
         c = conn.cursor()
         c.execute("SELECT * FROM license_keys WHERE key = ? AND used = 0 AND company_id = ?", (key, company["id"]))
         k = c.fetchone()
@@ -2161,7 +3783,9 @@ def activate():
         else:
             c.execute("UPDATE users SET is_activated = 1, license_key = ? WHERE id = ?", (key, user["id"]))
             c.execute("UPDATE license_keys SET assigned_to = ?, used = 1 WHERE id = ?", (user["id"], k["id"]))
+            bump_auth_version(c, user["id"])
             conn.commit()
+            refresh_current_user()
             msg = "Votre compte a été activé avec succès."
         conn.close()
     return render_template("activate.html", message=msg)
@@ -2175,7 +3799,7 @@ def billing():
     if user["role"] != "admin":
         return "Forbidden", 403
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_control_db()
     c = conn.cursor()
 
     if request.method == "POST":
@@ -2241,7 +3865,7 @@ def company_settings():
     if request.method == "POST":
         name = (request.form.get("name") or "").strip()
         domain = (request.form.get("domain") or "").strip() or None
-        conn = get_db()
+        conn = get_control_db()
         c = conn.cursor()
         c.execute("""
             UPDATE companies
@@ -2262,22 +3886,809 @@ def company_settings():
 def api_interventions():
     user = get_current_user()
     company = get_current_company(user)
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
     c.execute("SELECT * FROM interventions WHERE company_id = ? ORDER BY created_at DESC", (company["id"],))
     rows = [dict(row) for row in c.fetchall()]
     conn.close()
     return jsonify(rows)
 
+# ---------- Change feed ----------
+
+_last_change_log_compaction = {}
+
+def compact_change_log(c, now=None):
+    """Bound the size of change_log.
+
+    Rows superseded by a later change of the same entity are dropped first; that loses
+    nothing for a client catching up. Rows past the retention period or beyond
+    CHANGE_LOG_MAX_ROWS are then trimmed and change_log_floor is raised, so clients
+    asking for an older `since` are told to resync. Returns the number of rows deleted.
+    """
+    now = now or datetime.utcnow()
+    c.execute("""
+        DELETE FROM change_log
+        WHERE seq NOT IN (SELECT MAX(seq) FROM change_log GROUP BY entity, entity_id, user_id)
+    """)
+    deleted = c.rowcount
+    cutoff = (now - timedelta(days=CHANGE_LOG_RETENTION_DAYS)).isoformat()
+    c.execute("SELECT MAX(seq) FROM change_log WHERE changed_at < ?", (cutoff,))
+    floor = c.fetchone()[0] or 0
+    c.execute("SELECT seq FROM change_log ORDER BY seq DESC LIMIT 1 OFFSET ?", (CHANGE_LOG_MAX_ROWS,))
+    row = c.fetchone()
+    if row:
+        floor = max(floor, row[0])
+    if floor:
+        c.execute("DELETE FROM change_log WHERE seq <= ?", (floor,))
+        deleted += c.rowcount
+        c.execute("UPDATE change_log_floor SET seq = MAX(seq, ?) WHERE id = 1", (floor,))
+    return deleted
+
+def _maybe_compact_change_log(company_id=None):
+    key = tenant_db_path(company_id) if TENANT_SHARDING else DATABASE
+    ts = datetime.utcnow().timestamp()
+    if ts - _last_change_log_compaction.get(key, 0.0) < CHANGE_LOG_COMPACT_INTERVAL_SECONDS:
+        return
+    _last_change_log_compaction[key] = ts
+    conn = get_db(company_id)
+    compact_change_log(conn.cursor())
+    conn.commit()
+    conn.close()
+
+@app.route("/api/changes")
+@require_login
+def api_changes():
+    """Delta feed: rows changed after `since`, limited to what the caller can see.
+
+    Response: {"changes": [...], "next": <seq to pass as since>, "has_more": bool, "reset": bool}.
+    With "reset" true the requested position was compacted away: refetch the full list
+    (after reading "next") and continue from "next".
+    """
+    user = get_current_user()
+    company = get_current_company(user)
+    since = request.args.get("since", 0, type=int)
+    limit = max(1, min(request.args.get("limit", CHANGE_FEED_PAGE_SIZE, type=int), CHANGE_FEED_PAGE_SIZE))
+
+    _maybe_compact_change_log(company["id"])
+    conn = get_read_db()
+    c = conn.cursor()
+    c.execute("SELECT seq FROM change_log_floor WHERE id = 1")
+    floor = c.fetchone()["seq"]
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = c.fetchone()
+    head = row["seq"] if row else 0
+    # `since` ahead of head: the position comes from another database (restore, shard split)
+    if since < floor or since > head:
+        conn.close()
+        return jsonify({"changes": [], "next": head, "has_more": False, "reset": True})
+
+    query = "SELECT cl.* FROM change_log cl WHERE cl.company_id = ? AND cl.seq > ?"
+    params = [company["id"], since]
+    if user["role"] in ("tech", "employee"):
+        query += """ AND (cl.intervention_id IN (SELECT intervention_id FROM intervention_assignees WHERE user_id = ?)
+                          OR (cl.entity = 'assignee' AND cl.user_id = ?))"""
+        params += [user["id"], user["id"]]
+    elif user["role"] == "client":
+        query += " AND cl.intervention_id IN (SELECT id FROM interventions WHERE company_id = ? AND client_name = ?)"
+        params += [company["id"], user["username"]]
+    query += " ORDER BY cl.seq LIMIT ?"
+    params.append(limit)
+    c.execute(query, params)
+    rows = c.fetchall()
+
+    # keep the latest change per entity, then attach the current row
+    latest = {}
+    for r in rows:
+        latest[(r["entity"], r["entity_id"], r["user_id"])] = r
+    wanted = {"intervention": set(), "file": set()}
+    for entity, entity_id, _ in latest:
+        if entity in wanted:
+            wanted[entity].add(entity_id)
+    current = {}
+    for entity, table in (("intervention", "interventions"), ("file", "intervention_files")):
+        ids = sorted(wanted[entity])
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            c.execute(f"SELECT * FROM {table} WHERE company_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                      [company["id"]] + chunk)
+            for row in c.fetchall():
+                current[(entity, row["id"])] = dict(row)
+    conn.close()
+
+    changes = []
+    for r in sorted(latest.values(), key=lambda r: r["seq"]):
+        item = {"seq": r["seq"], "entity": r["entity"], "intervention_id": r["intervention_id"],
+                "op": r["op"], "changed_at": r["changed_at"]}
+        if r["entity"] == "assignee":
+            item["user_id"] = r["user_id"]
+        else:
+            item["id"] = r["entity_id"]
+            item["data"] = current.get((r["entity"], r["entity_id"]))
+            if item["data"] is None:
+                item["op"] = "delete"
+        changes.append(item)
+    return jsonify({
+        "changes": changes,
+        "next": rows[-1]["seq"] if rows else since,
+        "has_more": len(rows) == limit,
+        "reset": False,
+    })
+
+# ---------- Daily statistics ----------
+
+_last_daily_stats_refresh = {}
+
+def refresh_daily_stats(c, full=False):
+    """Bring daily_company_stats up to date with the interventions table.
+
+    Only interventions listed in change_log since the previous run are reprocessed, and
+    only the days they counted on before and after are recomputed; backlog and late_count
+    are then re-accumulated from the earliest touched day. The first run, or a run after
+    change_log was compacted past the last position, rebuilds everything.
+    A done intervention without completed_at is counted closed on tech_updated_at,
+    then on its creation day. Returns the number of interventions reprocessed.
+    """
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = c.fetchone()
+    head = row[0] if row else 0
+    c.execute("SELECT last_seq FROM daily_stats_state WHERE id = 1")
+    row = c.fetchone()
+    c.execute("SELECT seq FROM change_log_floor WHERE id = 1")
+    floor = c.fetchone()[0]
+    if row is None or row[0] < floor or row[0] > head:
+        full = True
+
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS stats_dirty (id INTEGER PRIMARY KEY)")
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS stats_days (company_id INTEGER, day TEXT, PRIMARY KEY (company_id, day))")
+    c.execute("DELETE FROM stats_dirty")
+    c.execute("DELETE FROM stats_days")
+    if full:
+        c.execute("INSERT INTO stats_dirty SELECT id FROM interventions UNION SELECT intervention_id FROM daily_stats_contrib")
+    else:
+        c.execute("INSERT OR IGNORE INTO stats_dirty SELECT intervention_id FROM change_log WHERE seq > ? AND entity = 'intervention'",
+                  (row[0],))
+    c.execute("SELECT COUNT(*) FROM stats_dirty")
+    dirty = c.fetchone()[0]
+
+    touched_days = """
+        INSERT OR IGNORE INTO stats_days
+        SELECT company_id, created_day FROM daily_stats_contrib WHERE intervention_id IN (SELECT id FROM stats_dirty)
+        UNION SELECT company_id, closed_day FROM daily_stats_contrib WHERE closed_day IS NOT NULL AND intervention_id IN (SELECT id FROM stats_dirty)
+        UNION SELECT company_id, late_day FROM daily_stats_contrib WHERE late_day IS NOT NULL AND intervention_id IN (SELECT id FROM stats_dirty)
+    """
+    c.execute(touched_days)  # days the dirty interventions counted on so far
+    c.execute("DELETE FROM daily_stats_contrib WHERE intervention_id IN (SELECT id FROM stats_dirty)")
+    c.execute("""
+        INSERT INTO daily_stats_contrib (intervention_id, company_id, created_day, closed_day, late_day, time_spent_minutes)
+        SELECT id, company_id, created_day, closed_day,
+               CASE WHEN late_day IS NOT NULL AND (closed_day IS NULL OR late_day < closed_day) THEN late_day END,
+               time_spent_minutes
+        FROM (
+            SELECT id, company_id, date(created_at) AS created_day,
+                   CASE WHEN status = 'done'
+                        THEN max(date(COALESCE(completed_at, tech_updated_at, created_at)), date(created_at)) END AS closed_day,
+                   CASE WHEN scheduled_date IS NOT NULL AND scheduled_date != ''
+                        THEN max(date(scheduled_date, '+1 day'), date(created_at)) END AS late_day,
+                   COALESCE(time_spent_minutes, 0) AS time_spent_minutes
+            FROM interventions
+            WHERE id IN (SELECT id FROM stats_dirty)
+        )
+        WHERE created_day IS NOT NULL
+    """)
+    c.execute(touched_days)  # and the days they count on now
+
+    c.execute("""
+        DELETE FROM daily_company_stats
+        WHERE EXISTS (SELECT 1 FROM stats_days d WHERE d.company_id = daily_company_stats.company_id AND d.day = daily_company_stats.day)
+    """)
+    c.execute("""
+        INSERT INTO daily_company_stats (company_id, day, created_count, closed_count, late_delta, time_spent_closed_minutes)
+        SELECT company_id, day, created_count, closed_count, late_delta, time_spent
+        FROM (
+            SELECT d.company_id, d.day,
+                   (SELECT COUNT(*) FROM daily_stats_contrib x WHERE x.company_id = d.company_id AND x.created_day = d.day) AS created_count,
+                   (SELECT COUNT(*) FROM daily_stats_contrib x WHERE x.company_id = d.company_id AND x.closed_day = d.day) AS closed_count,
+                   (SELECT COUNT(*) FROM daily_stats_contrib x WHERE x.company_id = d.company_id AND x.late_day = d.day)
+                 - (SELECT COUNT(*) FROM daily_stats_contrib x WHERE x.company_id = d.company_id AND x.closed_day = d.day AND x.late_day IS NOT NULL) AS late_delta,
+                   (SELECT COALESCE(SUM(time_spent_minutes), 0) FROM daily_stats_contrib x WHERE x.company_id = d.company_id AND x.closed_day = d.day) AS time_spent
+            FROM stats_days d
+        )
+        WHERE created_count OR closed_count OR late_delta
+    """)
+
+    # re-accumulate the running totals from the first touched day of each company
+    c.execute("SELECT company_id, MIN(day) FROM stats_days GROUP BY company_id")
+    for company_id, first_day in c.fetchall():
+        c.execute("""
+            SELECT backlog, late_count FROM daily_company_stats
+            WHERE company_id = ? AND day < ? ORDER BY day DESC LIMIT 1
+        """, (company_id, first_day))
+        base = c.fetchone() or (0, 0)
+        c.execute("""
+            UPDATE daily_company_stats
+            SET backlog = ? + r.backlog, late_count = ? + r.late_count
+            FROM (
+                SELECT day,
+                       SUM(created_count - closed_count) OVER (ORDER BY day) AS backlog,
+                       SUM(late_delta) OVER (ORDER BY day) AS late_count
+                FROM daily_company_stats
+                WHERE company_id = ? AND day >= ?
+            ) AS r
+            WHERE daily_company_stats.company_id = ? AND daily_company_stats.day = r.day
+        """, (base[0], base[1], company_id, first_day, company_id))
+
+    c.execute("""
+        INSERT INTO daily_stats_state (id, last_seq, refreshed_at) VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET last_seq = excluded.last_seq, refreshed_at = excluded.refreshed_at
+    """, (head, datetime.utcnow().isoformat()))
+    return dirty
+
+def _maybe_refresh_daily_stats(company_id=None):
+    key = tenant_db_path(company_id) if TENANT_SHARDING else DATABASE
+    ts = datetime.utcnow().timestamp()
+    if ts - _last_daily_stats_refresh.get(key, 0.0) < DAILY_STATS_REFRESH_INTERVAL_SECONDS:
+        return
+    _last_daily_stats_refresh[key] = ts
+    conn = get_db(company_id)
+    refresh_daily_stats(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def _parse_day(value, default):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else default
+    except ValueError:
+        return default
+
+@app.route("/api/stats/daily")
+@require_login
+def api_stats_daily():
+    """Per-day created / closed / backlog / late figures, read from daily_company_stats.
+
+    Every day of [from, to] is returned; days without activity carry the previous totals.
+    """
+    user = get_current_user()
+    if user["role"] not in ("admin", "owner", "manager"):
+        return jsonify({"error": "forbidden"}), 403
+    company = get_current_company(user)
+    today = datetime.utcnow().date()
+    day_to = _parse_day(request.args.get("to"), today)
+    day_from = _parse_day(request.args.get("from"), day_to - timedelta(days=29))
+    if day_from > day_to:
+        return jsonify({"error": "from must not be after to"}), 400
+    if (day_to - day_from).days >= DAILY_STATS_MAX_RANGE_DAYS:
+        return jsonify({"error": f"range limited to {DAILY_STATS_MAX_RANGE_DAYS} days"}), 400
+
+    _maybe_refresh_daily_stats(company["id"])
+    conn = get_read_db()
+    c = conn.cursor()
+    c.execute("""
+        SELECT backlog, late_count FROM daily_company_stats
+        WHERE company_id = ? AND day < ? ORDER BY day DESC LIMIT 1
+    """, (company["id"], day_from.isoformat()))
+    previous = c.fetchone()
+    backlog, late = (previous["backlog"], previous["late_count"]) if previous else (0, 0)
+    c.execute("""
+        SELECT * FROM daily_company_stats
+        WHERE company_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day
+    """, (company["id"], day_from.isoformat(), day_to.isoformat()))
+    rows = {r["day"]: r for r in c.fetchall()}
+    conn.close()
+
+    days = []
+    day = day_from
+    while day <= day_to:
+        r = rows.get(day.isoformat())
+        created = closed = spent = 0
+        if r:
+            created, closed, spent = r["created_count"], r["closed_count"], r["time_spent_closed_minutes"]
+            backlog, late = r["backlog"], r["late_count"]
+        days.append({
+            "day": day.isoformat(),
+            "created": created,
+            "closed": closed,
+            "backlog": backlog,
+            "late": late,
+            "late_ratio": round(late / backlog, 4) if backlog else 0.0,
+            "avg_time_spent_minutes": round(spent / closed, 1) if closed else None,
+        })
+        day += timedelta(days=1)
+    return jsonify({"from": day_from.isoformat(), "to": day_to.isoformat(), "days": days})
+
+# ---------- Analytics ----------
+
+class VersionedCache:
+    """LRU of computed results, each stored with the data version it was computed at.
+
+    A lookup with a different version is a miss, so writes invalidate entries without
+    any explicit purge: the next reader recomputes and replaces them.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, version, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+analytics_cache = VersionedCache(ANALYTICS_CACHE_ENTRIES)
+lookup_cache = VersionedCache(LOOKUP_CACHE_ENTRIES)
+
+def company_data_version(c, company_id):
+    """Latest change_log position of the company: changes whenever its interventions do."""
+    c.execute("SELECT MAX(seq) FROM change_log WHERE company_id = ?", (company_id,))
+    return c.fetchone()[0] or 0
+
+def _analytics_filters():
+    today = datetime.utcnow().date()
+    day_to = _parse_day(request.args.get("to"), today)
+    day_from = _parse_day(request.args.get("from"), day_to - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    return {
+        "date_from": min(day_from, day_to).isoformat(),
+        "date_to": day_to.isoformat(),
+        "customer_id": request.args.get("customer_id", type=int),
+        "priority": (request.args.get("priority") or "").strip() or None,
+    }
+
+def _working_days(date_from, date_to):
+    day, end = datetime.strptime(date_from, "%Y-%m-%d").date(), datetime.strptime(date_to, "%Y-%m-%d").date()
+    full_weeks, rest = divmod((end - day).days + 1, 7)
+    count = full_weeks * 5
+    for i in range(rest):
+        if (day + timedelta(days=full_weeks * 7 + i)).weekday() < 5:
+            count += 1
+    return count
+
+ANALYTICS_WIDGETS = {
+    "mttr": lambda c, cid, f: analytics_ops.mean_time_to_repair(c, cid, f),
+    "technicians": lambda c, cid, f: analytics_ops.technician_throughput(
+        c, cid, f, _working_days(f["date_from"], f["date_to"])),
+    "equipment": lambda c, cid, f: analytics_ops.equipment_failures(c, cid, f),
+}
+
+@app.route("/api/analytics/<widget>")
+@require_login
+def api_analytics(widget):
+    """MTTR, technician throughput or equipment MTBF for ?from=&to=&customer_id=&priority=."""
+    user = get_current_user()
+    if user["role"] not in ("admin", "owner", "manager"):
+        return jsonify({"error": "forbidden"}), 403
+    if widget not in ANALYTICS_WIDGETS:
+        return jsonify({"error": "unknown widget"}), 404
+    company_id = get_current_company(user)["id"]
+    filters = _analytics_filters()
+
+    conn = get_read_db()
+    c = conn.cursor()
+    version = (company_data_version(c, company_id), company_lookup_version(c, company_id))
+    key = (widget, company_id, tuple(sorted(filters.items())))
+    result = analytics_cache.get_or_compute(key, version, lambda: ANALYTICS_WIDGETS[widget](c, company_id, filters))
+    conn.close()
+    return jsonify(dict(result, filters=filters))
+
+# ---------- Template caches ----------
+
+def _jinja_bytecode_cache():
+    try:
+        os.makedirs(JINJA_BYTECODE_DIR, exist_ok=True)
+    except OSError:
+        return None  # read-only filesystem: every worker compiles its templates
+    return FileSystemBytecodeCache(JINJA_BYTECODE_DIR, "maintcontrol-%s.cache")
+
+app.jinja_env.bytecode_cache = _jinja_bytecode_cache()
+
+fragment_cache = VersionedCache(FRAGMENT_CACHE_ENTRIES)
+
+class LazyResult:
+    """Query result computed on first use.
+
+    Views hand these to templates: a {% cache %} hit never evaluates the fragment body,
+    so the queries behind it do not run at all.
+    """
+
+    __slots__ = ("_loader", "_value", "_loaded")
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+
+    def get(self):
+        if not self._loaded:
+            self._value = self._loader()
+            self._loaded = True
+        return self._value
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __len__(self):
+        return len(self.get())
+
+    def __bool__(self):
+        return bool(self.get())
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def time_window():
+    """Index of the current PAGE_ETAG_WINDOW_SECONDS window, for time-dependent fragments."""
+    return int(time.time() // PAGE_ETAG_WINDOW_SECONDS)
+
+# Roles that see the whole company: other users get fragments of their own.
+FRAGMENT_SHARED_ROLES = ("admin", "owner", "manager")
+
+def request_data_version():
+    """Data version of the current user's company, read once per request.
+
+    Covers its interventions (change_log) and the customers, equipments, contracts,
+    users and company settings shown beside them (company_data_versions).
+    """
+    if "request_data_version" not in g:
+        user = get_current_user()
+        version = None
+        if user:
+            company_id = user["company_id"]
+            conn = get_read_db()
+            c = conn.cursor()
+            version = (company_data_version(c, company_id), company_lookup_version(c, company_id))
+            conn.close()
+        g.request_data_version = version
+    return g.request_data_version
+
+def fragment_cache_scope():
+    """(version, key prefix) of the current request, or None when fragments are not cached.
+
+    The prefix pins the company, language and role (and user for scoped roles).
+    """
+    if not has_request_context() or app.debug or FRAGMENT_CACHE_ENTRIES <= 0:
+        return None
+    version = request_data_version()
+    if version is None:
+        return None
+    user = get_current_user()
+    audience = user["role"] if user["role"] in FRAGMENT_SHARED_ROLES else (user["role"], user["id"])
+    return version, (user["company_id"], session.get("lang", DEFAULT_LANG), audience)
+
+class FragmentCacheExtension(Extension):
+    """`{% cache "name", extra_key... %}...{% endcache %}` renders the body once per data version.
+
+    Extra key parts (filters, day) are added to the request scope of fragment_cache_scope().
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render", [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        scope = fragment_cache_scope()
+        if scope is None:
+            return caller()
+        version, prefix = scope
+        key = prefix + tuple(str(p) for p in parts)
+        return fragment_cache.get_or_compute(key, version, caller)
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# ---------- Metrics (Prometheus) ----------
+
+class RequestMetrics:
+    """SQL statements and time of one request, filled by MetricsConnection."""
+
+    __slots__ = ("started", "statements", "sql_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+    def count_statement(self, sql):
+        if not sql.startswith("--"):  # statements run by triggers are reported as comments
+            self.statements += 1
+
+class RouteMetrics:
+    """Per-endpoint latency histogram and SQL totals of this worker process."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, statements, sql_seconds):
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = {
+                    "buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0,
+                    "statements": 0, "sql_seconds": 0.0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    route["buckets"][i] += 1
+            route["count"] += 1
+            route["sum"] += seconds
+            route["statements"] += statements
+            route["sql_seconds"] += sql_seconds
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            routes = {name: dict(r, buckets=list(r["buckets"])) for name, r in sorted(self._routes.items())}
+        lines = [
+            "# HELP maintcontrol_request_duration_seconds Request latency by endpoint.",
+            "# TYPE maintcontrol_request_duration_seconds histogram",
+        ]
+        for name, r in routes.items():
+            for bound, n in zip(self.buckets, r["buckets"]):
+                lines.append(f'maintcontrol_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {n}')
+            lines.append(f'maintcontrol_request_duration_seconds_bucket{{endpoint="{name}",le="+Inf"}} {r["count"]}')
+            lines.append(f'maintcontrol_request_duration_seconds_sum{{endpoint="{name}"}} {r["sum"]:.6f}')
+            lines.append(f'maintcontrol_request_duration_seconds_count{{endpoint="{name}"}} {r["count"]}')
+        lines += [
+            "# HELP maintcontrol_sql_statements_total SQL statements executed, by endpoint.",
+            "# TYPE maintcontrol_sql_statements_total counter",
+        ]
+        lines += [f'maintcontrol_sql_statements_total{{endpoint="{name}"}} {r["statements"]}' for name, r in routes.items()]
+        lines += [
+            "# HELP maintcontrol_sql_seconds_total Time spent executing and fetching SQL, by endpoint.",
+            "# TYPE maintcontrol_sql_seconds_total counter",
+        ]
+        lines += [f'maintcontrol_sql_seconds_total{{endpoint="{name}"}} {r["sql_seconds"]:.6f}' for name, r in routes.items()]
+        return "\n".join(lines) + "\n"
+
+route_metrics = RouteMetrics(METRICS_LATENCY_BUCKETS)
+
+def start_request_metrics():
+    g.request_metrics = RequestMetrics()
+
+def record_request_metrics(exc=None):
+    metrics = g.pop("request_metrics", None)
+    if metrics is not None:
+        route_metrics.observe(request.endpoint or "unmatched", time.perf_counter() - metrics.started,
+                              metrics.statements, metrics.sql_seconds)
+
+if METRICS_ENABLED:
+    app.before_request(start_request_metrics)
+    app.teardown_request(record_request_metrics)
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: admin users, or `Authorization: Bearer <METRICS_TOKEN>`."""
+    if not METRICS_ENABLED:
+        return "Not found", 404
+    auth = request.headers.get("Authorization", "")
+    if not (METRICS_TOKEN and secrets.compare_digest(auth, f"Bearer {METRICS_TOKEN}")):
+        user = get_current_user()
+        if not user:
+            return redirect(url_for("login"))
+        if user["role"] != "admin":
+            return "Forbidden", 403
+    resp = app.response_class(route_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+# ---------- Live events (SSE) ----------
+
+LIVE_EVENT_FIELDS = ("id", "title", "status", "priority", "client_name", "technician_name", "scheduled_date")
+
+class ChangeBroadcaster:
+    """Fan-out of intervention changes to SSE subscribers, one instance per worker.
+
+    A single daemon thread polls `PRAGMA data_version` on one read-only connection per
+    database file (the single database, or each shard with subscribers) and only reads
+    change_log when another connection has committed. Subscribers get a bounded queue;
+    a subscriber that falls behind receives a "resync" event instead of the backlog.
+    Status transitions come from change_log.old_status, so the poller keeps no
+    per-intervention state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # company_id -> set of queues
+        self._sources = {}      # db path -> [conn, data_version, last_seq]
+        self._thread = None
+
+    def subscribe(self, company_id):
+        """Queue of SSE messages for the company, or None when the worker is at SSE_MAX_SUBSCRIBERS."""
+        q = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self._lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= SSE_MAX_SUBSCRIBERS:
+                return None
+            self._subscribers.setdefault(company_id, set()).add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sse-poller", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, company_id, q):
+        with self._lock:
+            subs = self._subscribers.get(company_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self._subscribers[company_id]
+
+    def _run(self):
+        while True:
+            time.sleep(SSE_POLL_INTERVAL_SECONDS)
+            with self._lock:
+                companies = list(self._subscribers)
+            by_path = {}
+            for cid in companies:
+                path = tenant_db_path(cid) if TENANT_SHARDING else DATABASE
+                by_path.setdefault(path, set()).add(cid)
+            for path in list(self._sources):
+                if path not in by_path:
+                    self._sources.pop(path)[0].close()
+            for path, cids in by_path.items():
+                try:
+                    self._poll(path, cids)
+                except sqlite3.Error as e:
+                    print(f"[MaintControl] SSE poll failed for {path}: {e}")
+                    source = self._sources.pop(path, None)
+                    if source:
+                        source[0].close()
+
+    def _poll(self, path, cids):
+        source = self._sources.get(path)
+        if source is None:
+            conn = get_read_db(next(iter(cids))) if TENANT_SHARDING else _connect_ro(DATABASE)
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            self._sources[path] = [conn, version, row["seq"] if row else 0]
+            return
+        conn, version, last_seq = source
+        current = conn.execute("PRAGMA data_version").fetchone()[0]
+        if current == version:
+            return
+        source[1] = current
+        rows = conn.execute("""
+            SELECT seq, company_id, intervention_id, op, old_status FROM change_log
+            WHERE seq > ? AND entity = 'intervention'
+            ORDER BY seq
+        """, (last_seq,)).fetchall()
+        head = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        source[2] = max(last_seq, head["seq"] if head else 0)
+
+        latest = {}  # intervention id -> (last row, first op, status before this batch)
+        for r in rows:
+            if r["company_id"] in cids:
+                first = latest.get(r["intervention_id"])
+                if first:
+                    latest[r["intervention_id"]] = (r, first[1], first[2] or r["old_status"])
+                else:
+                    latest[r["intervention_id"]] = (r, r["op"], r["old_status"])
+        if not latest:
+            return
+        ids = list(latest)
+        current_rows = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for row in conn.execute(f"SELECT {', '.join(LIVE_EVENT_FIELDS)} FROM interventions WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                current_rows[row["id"]] = dict(row)
+
+        for iid, (r, first_op, previous) in sorted(latest.items(), key=lambda kv: kv[1][0]["seq"]):
+            data = current_rows.get(iid)
+            if data is None:
+                name, data = "deleted", {"id": iid}
+            elif first_op == "insert":
+                name = "created"
+            elif previous is not None and previous != data["status"]:
+                name = "status"
+                data["previous_status"] = previous
+            else:
+                name = "updated"
+            self._publish(r["company_id"], r["seq"], name, data)
+
+    def _publish(self, company_id, seq, name, data):
+        message = f"id: {seq}\nevent: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+        with self._lock:
+            subs = list(self._subscribers.get(company_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait("event: resync\ndata: {}\n\n")
+
+change_broadcaster = ChangeBroadcaster()
+
+@app.route("/api/events")
+@require_login
+def events_stream():
+    """SSE stream of intervention created / updated / status / deleted events for the company."""
+    user = get_current_user()
+    if user["role"] not in ("admin", "owner", "manager"):
+        return "Forbidden", 403
+    if not (request.environ.get("wsgi.multithread") or SSE_ASYNC_WORKER):
+        # A sync worker would be tied up by the stream: 204 tells EventSource not to
+        # reconnect, and the page falls back to polling /api/live/<page>.
+        return "", 204
+    company_id = get_current_company(user)["id"]
+    q = change_broadcaster.subscribe(company_id)
+    if q is None:
+        return "", 204  # every stream slot of this worker is taken: poll instead
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            change_broadcaster.unsubscribe(company_id, q)
+
+    resp = app.response_class(stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # nginx: do not buffer the stream
+    return resp
+
+# Pages with live regions: template, context builder and the {% block live_<name> %} regions.
+LIVE_PAGES = {
+    "dashboard": ("dashboard.html", dashboard_context, ("kpi", "recent", "ai")),
+    "planning": ("planning.html", planning_context, ("today", "overdue", "upcoming")),
+}
+
+def render_live_regions(template_name, regions, context):
+    """Render only the live_<region> blocks of a page template."""
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    ctx = template.new_context(context)
+    return {name: "".join(template.blocks[f"live_{name}"](ctx)) for name in regions}
+
+@app.route("/api/live/<page>")
+@require_login
+@conditional_page
+def api_live_regions(page):
+    """HTML of the live regions of the dashboard or planning (?regions=kpi,recent).
+
+    Only the queries behind the requested regions run (and none for cached fragments).
+    """
+    user = get_current_user()
+    if user["role"] not in ("admin", "owner", "manager"):
+        return jsonify({"error": "forbidden"}), 403
+    if page not in LIVE_PAGES:
+        return jsonify({"error": "unknown page"}), 404
+    template_name, build_context, names = LIVE_PAGES[page]
+    wanted = [r for r in request.args.get("regions", "").split(",") if r in names] or list(names)
+    context = build_context(user, get_current_company(user)["id"])
+    return jsonify({"regions": render_live_regions(template_name, wanted, context)})
+
 @app.route("/i18n/<lang>.json")
 def i18n(lang):
     if lang not in SUPPORTED_LANGS:
         lang = DEFAULT_LANG
-    path = os.path.join(BASE_DIR, "i18n", f"{lang}.json")
-    if not os.path.exists(path):
-        lang = DEFAULT_LANG
-        path = os.path.join(BASE_DIR, "i18n", f"{lang}.json")
-    return send_file(path, mimetype="application/json")
+    body, etag = I18N_PAYLOADS[lang]
+    resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "public, max-age=86400, stale-while-revalidate=604800"
+    return resp.make_conditional(request)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -1,25 +1,5 @@
-
-async function loadTranslations(lang) {
-  try {
-    const res = await fetch(`/i18n/${lang}.json`);
-    if (!res.ok) return;
-    const dict = await res.json();
-    document.querySelectorAll("[data-i18n]").forEach(el => {
-      const key = el.getAttribute("data-i18n");
-      if (dict[key]) {
-        el.textContent = dict[key];
-      }
-    });
-  } catch (e) {
-    console.error("i18n error", e);
-  }
-}
-
-document.addEventListener("DOMContentLoaded", () => {
-  const lang = document.body.getAttribute("data-lang") || "fr";
-  loadTranslations(lang);
-});
-
+// Pages are rendered already translated (Jinja t() helper); /i18n/<lang>.json
+// remains available for scripts that need the catalog.
 
 // UX helpers
 document.addEventListener("click", (e) => {
@@ -34,3 +14,278 @@ document.addEventListener("click", (e) => {
     if (opt.value === myId) opt.selected = true;
   });
 });
+
+// Offline queue for technician updates: forms marked data-offline-sync are
+// stored in localStorage and replayed in one batch via POST /api/tech/sync,
+// so a status change or signature taken without signal is not lost.
+// Mutations the server will not apply as sent (a conflict, or a batch refused
+// with a 4xx other than 409 / 429) move to mc.syncConflicts with the server
+// state; the intervention page puts them back in its forms to be re-saved.
+const SYNC_KEY = "mc.syncQueue";
+const CONFLICT_KEY = "mc.syncConflicts";
+const SYNC_BATCH_SIZE = 200;  // TECH_SYNC_MAX_MUTATIONS on the server
+
+function loadSyncQueue() {
+  try { return JSON.parse(localStorage.getItem(SYNC_KEY)) || []; } catch (e) { return []; }
+}
+
+function saveSyncQueue(queue) {
+  localStorage.setItem(SYNC_KEY, JSON.stringify(queue));
+}
+
+function loadSyncConflicts() {
+  try { return JSON.parse(localStorage.getItem(CONFLICT_KEY)) || []; } catch (e) { return []; }
+}
+
+function saveSyncConflicts(parked) {
+  localStorage.setItem(CONFLICT_KEY, JSON.stringify(parked));
+}
+
+function retryable(status) {
+  return status === 409 || status === 429 || status >= 500;
+}
+
+function syncStatus(key, extra) {
+  const el = document.getElementById("syncStatus");
+  if (!el) return;
+  el.textContent = (el.getAttribute("data-msg-" + key) || "") + (extra ? " " + extra : "");
+  el.hidden = false;
+}
+
+let syncInFlight = null;
+
+function flushSyncQueue() {
+  if (syncInFlight) return syncInFlight;
+  const queue = loadSyncQueue();
+  if (!queue.length) return Promise.resolve(null);
+  const batch = queue.slice(0, SYNC_BATCH_SIZE);
+  const field = document.querySelector("input[name=csrf_token]");
+  const token = field ? field.value : batch[batch.length - 1].csrf;
+  const mutations = batch.map(({ csrf, ...m }) => m);
+  syncInFlight = fetch("/api/tech/sync", {
+    method: "POST",
+    credentials: "same-origin",
+    headers: { "Content-Type": "application/json", "X-CSRFToken": token },
+    body: JSON.stringify({ mutations }),
+  })
+    .then(r => {
+      if (r.ok) return r.json();
+      if (retryable(r.status)) throw new Error("sync " + r.status);
+      // refused as a whole: resending the same batch cannot succeed
+      return { results: batch.map(m => ({ id: m.id, status: "rejected" })) };
+    })
+    .then(data => {
+      // every answered mutation leaves the queue; items queued meanwhile stay
+      const answered = new Set(data.results.map(r => r.id));
+      saveSyncQueue(loadSyncQueue().filter(m => !answered.has(m.id)));
+      const byId = new Map(batch.map(m => [m.id, m]));
+      const parked = data.results.filter(r => (r.status === "conflict" || r.status === "rejected") && byId.has(r.id));
+      if (parked.length) {
+        saveSyncConflicts(loadSyncConflicts().concat(parked.map(r => {
+          const { csrf, ...m } = byId.get(r.id);
+          return { ...m, status: r.status, server: r.server || null };
+        })));
+        const conflicts = parked.filter(r => r.status === "conflict");
+        if (conflicts.length) syncStatus("conflict", conflicts.map(r => "#" + byId.get(r.id).intervention_id).join(", "));
+        else syncStatus("rejected");
+      }
+      if (batch.length === SYNC_BATCH_SIZE && loadSyncQueue().length) setTimeout(flushSyncQueue, 0);
+      return data.results;
+    })
+    .catch(() => {
+      syncStatus("queued", "(" + loadSyncQueue().length + ")");
+      return null;
+    })
+    .finally(() => { syncInFlight = null; });
+  return syncInFlight;
+}
+
+document.addEventListener("submit", (e) => {
+  const form = e.target.closest("form[data-offline-sync]");
+  if (!form) return;
+  e.preventDefault();
+  const interventionId = Number(form.getAttribute("data-intervention-id"));
+  const type = form.getAttribute("data-offline-sync");
+  // re-saving the form settles what was parked for it
+  saveSyncConflicts(loadSyncConflicts().filter(m => m.intervention_id !== interventionId || m.type !== type));
+  const data = new FormData(form);
+  const fields = {};
+  data.forEach((v, k) => { if (k !== "csrf_token") fields[k] = v; });
+  const mutation = {
+    id: Date.now().toString(36) + Math.random().toString(36).slice(2, 8),
+    intervention_id: interventionId,
+    type,
+    base_updated_at: form.getAttribute("data-base-updated-at") || null,
+    fields,
+    csrf: data.get("csrf_token"),
+  };
+  saveSyncQueue(loadSyncQueue().concat([mutation]));
+  flushSyncQueue().then(results => {
+    const mine = results && results.find(r => r.id === mutation.id);
+    if (mine && mine.status === "applied") window.location.reload();
+    else if (mine && mine.status !== "conflict") syncStatus("rejected");
+  });
+});
+
+// Put parked mutations back in the forms of this page (latest one wins) so the
+// technician can merge them with the current state and save again.
+function restoreSyncConflicts() {
+  const shown = [];
+  loadSyncConflicts().forEach(m => {
+    const form = document.querySelector(
+      `form[data-offline-sync="${m.type}"][data-intervention-id="${m.intervention_id}"]`);
+    if (!form) return;
+    Object.entries(m.fields || {}).forEach(([name, value]) => {
+      const el = form.elements[name];
+      if (el && name !== "csrf_token") el.value = value;
+    });
+    form.dispatchEvent(new CustomEvent("mc:sync-restore", { detail: m.fields || {} }));
+    shown.push("#" + m.intervention_id);
+  });
+  if (shown.length) syncStatus("conflict", Array.from(new Set(shown)).join(", "));
+}
+
+window.addEventListener("online", flushSyncQueue);
+document.addEventListener("DOMContentLoaded", () => {
+  restoreSyncConflicts();
+  flushSyncQueue();
+});
+
+// Live dashboard / planning: pages whose title carries data-live-events listen
+// to the company's SSE stream. Known rows are patched from the event payload;
+// once per burst of changes, only the data-live-region blocks whose data-live-on
+// lists one of the events are re-fetched from data-live-regions (/api/live/<page>).
+// When the server cannot hold a stream open (204), the regions are polled instead.
+const LIVE_REFRESH_DELAY_MS = 1500;
+const LIVE_POLL_INTERVAL_MS = 30000;
+
+function refreshLiveRegions(root, names) {
+  const url = new URL(root.getAttribute("data-live-regions"), window.location.origin);
+  if (names) url.searchParams.set("regions", Array.from(names).join(","));
+  fetch(url, { credentials: "same-origin" })
+    .then(r => (r.ok ? r.json() : Promise.reject(r.status)))
+    .then(data => {
+      Object.entries(data.regions).forEach(([name, html]) => {
+        const el = document.querySelector(`[data-live-region="${name}"]`);
+        const tpl = document.createElement("template");
+        tpl.innerHTML = html.trim();
+        const fresh = tpl.content.querySelector(`[data-live-region="${name}"]`);
+        if (el && fresh && el.outerHTML !== fresh.outerHTML) el.replaceWith(fresh);
+      });
+    })
+    .catch(() => {});
+}
+
+function liveRegionsFor(eventName) {
+  return Array.from(document.querySelectorAll("[data-live-region]"))
+    .filter(el => !eventName || (el.getAttribute("data-live-on") || "").split(" ").includes(eventName))
+    .map(el => el.getAttribute("data-live-region"));
+}
+
+function patchInterventionRows(data) {
+  document.querySelectorAll(`tr[data-intervention-id="${data.id}"]`).forEach(tr => {
+    tr.querySelectorAll("[data-field]").forEach(td => {
+      const value = data[td.getAttribute("data-field")];
+      if (value !== undefined) td.textContent = value == null ? "" : value;
+    });
+  });
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  const root = document.querySelector("[data-live-events]");
+  if (!root) return;
+  let polling = false;
+  const startPolling = () => {
+    if (polling) return;
+    polling = true;
+    setInterval(() => refreshLiveRegions(root, null), LIVE_POLL_INTERVAL_MS);
+  };
+  if (!window.EventSource) {
+    startPolling();
+    return;
+  }
+  const source = new EventSource(root.getAttribute("data-live-events"));
+  source.addEventListener("error", () => {
+    if (source.readyState === EventSource.CLOSED) startPolling();
+  });
+  const pending = new Set();
+  let timer = null;
+  const scheduleRefresh = names => {
+    names.forEach(n => pending.add(n));
+    if (!pending.size) return;
+    clearTimeout(timer);
+    timer = setTimeout(() => {
+      const batch = new Set(pending);
+      pending.clear();
+      refreshLiveRegions(root, batch);
+    }, LIVE_REFRESH_DELAY_MS);
+  };
+  ["created", "updated", "status", "deleted"].forEach(name => {
+    source.addEventListener(name, e => {
+      const data = JSON.parse(e.data);
+      if (name === "updated" || name === "status") patchInterventionRows(data);
+      scheduleRefresh(liveRegionsFor(name));
+    });
+  });
+  source.addEventListener("resync", () => scheduleRefresh(liveRegionsFor(null)));
+});
+
+// Async pickers (templates/_lookup.html): typing queries /api/lookup/<kind>
+// and choosing a result fills the hidden id field. data-lookup-filter names a
+// sibling field (customer_id) whose value narrows the search.
+const LOOKUP_DELAY_MS = 200;
+
+function runLookup(box, q) {
+  const url = new URL(box.getAttribute("data-lookup"), window.location.origin);
+  url.searchParams.set("q", q);
+  const filter = box.getAttribute("data-lookup-filter");
+  const form = box.closest("form");
+  const filterField = filter && form ? form.querySelector(`input[name="${filter}"]`) : null;
+  if (filterField && filterField.value) url.searchParams.set(filter, filterField.value);
+  const seq = (box.lookupSeq = (box.lookupSeq || 0) + 1);
+  fetch(url, { credentials: "same-origin" })
+    .then(r => r.json())
+    .then(data => {
+      if (seq !== box.lookupSeq) return; // a newer query is in flight
+      const list = box.querySelector(".lookup-results");
+      list.innerHTML = "";
+      data.results.forEach(r => {
+        const li = document.createElement("li");
+        li.textContent = r.label;
+        li.setAttribute("data-id", r.id);
+        list.appendChild(li);
+      });
+      list.hidden = !data.results.length;
+    })
+    .catch(() => {});
+}
+
+document.addEventListener("input", (e) => {
+  const input = e.target.closest(".lookup-input");
+  if (!input) return;
+  const box = input.closest(".lookup");
+  box.querySelector("input[type=hidden]").value = ""; // edited text no longer names a record
+  clearTimeout(box.lookupTimer);
+  box.lookupTimer = setTimeout(() => runLookup(box, input.value), LOOKUP_DELAY_MS);
+});
+
+document.addEventListener("focusin", (e) => {
+  const input = e.target.closest(".lookup-input");
+  if (input) runLookup(input.closest(".lookup"), input.value);
+});
+
+// mousedown rather than click: it fires before the search box loses focus
+document.addEventListener("mousedown", (e) => {
+  const li = e.target.closest(".lookup-results li");
+  if (li) {
+    const box = li.closest(".lookup");
+    box.querySelector("input[type=hidden]").value = li.getAttribute("data-id");
+    box.querySelector(".lookup-input").value = li.textContent;
+    li.parentNode.hidden = true;
+    e.preventDefault();
+    return;
+  }
+  document.querySelectorAll(".lookup-results").forEach(list => {
+    if (!list.closest(".lookup").contains(e.target)) list.hidden = true;
+  });
+});
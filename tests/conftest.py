@@ -0,0 +1,11 @@
+"""Shared setup: the app is imported against a fresh database in a temporary directory."""
+import os
+import sys
+import tempfile
+
+TMP = tempfile.mkdtemp(prefix="maintcontrol-tests-")
+os.environ["MAINTCONTROL_DB"] = os.path.join(TMP, "maintcontrol.db")
+os.environ["UPLOAD_DIR"] = os.path.join(TMP, "uploads")
+os.environ["JINJA_BYTECODE_DIR"] = os.path.join(TMP, "jinja")
+os.environ["ADMIN_USERNAME"] = os.environ["ADMIN_PASSWORD"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
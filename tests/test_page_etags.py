@@ -0,0 +1,163 @@
+"""Conditional GET on list / dashboard pages: every write route must change the ETag.
+
+Run with:  python -m pytest tests
+"""
+import io
+
+import pytest
+
+import app as mc
+
+PASSWORD = "test-password-123"
+PAGES = ["/dashboard", "/interventions", "/interventions?status=open", "/planning", "/equipments", "/contracts"]
+TECH_ID = 3  # tech1 in the demo data created by init_db()
+
+
+@pytest.fixture(scope="module")
+def clients():
+    mc.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    mc.schedule_thumbnails = lambda *args: None
+    conn = mc.get_control_db()
+    conn.execute("UPDATE users SET password = ?", (mc.hash_password(PASSWORD),))
+    conn.commit()
+    conn.close()
+    admin, tech = mc.app.test_client(), mc.app.test_client()
+    for client, username in ((admin, "admin"), (tech, "tech1")):
+        assert client.post("/login", data={"username": username, "password": PASSWORD}).status_code == 302
+    return admin, tech
+
+
+def _last_id(table):
+    conn = mc.get_db()
+    row = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()
+    conn.close()
+    return row[0]
+
+
+def _tech_updated_at(intervention_id):
+    conn = mc.get_db()
+    row = conn.execute("SELECT tech_updated_at FROM interventions WHERE id = ?", (intervention_id,)).fetchone()
+    conn.close()
+    return row[0]
+
+
+@pytest.fixture
+def env(clients, monkeypatch):
+    """Fresh customer / equipment / contract / intervention (assigned to tech1) per test."""
+    monkeypatch.setattr(mc, "time_window", lambda: 0)  # no window rollover mid-test
+    admin, tech = clients
+    admin.post("/customers", data={"name": "ACME"}, follow_redirects=True)
+    customer_id = _last_id("customers")
+    admin.post("/equipments/new", data={"name": "Pump", "customer_id": customer_id}, follow_redirects=True)
+    admin.post("/contracts/new", data={"name": "Gold", "customer_id": customer_id, "visits_per_year": "2",
+                                       "is_active": "1"}, follow_redirects=True)
+    admin.post("/interventions/new", data={"title": "Leak", "client_name": "ACME", "customer_id": customer_id,
+                                           "assignees": [str(TECH_ID)], "scheduled_date": "2020-01-01"},
+               follow_redirects=True)
+    return {
+        "admin": admin, "tech": tech, "customer": customer_id, "equipment": _last_id("equipments"),
+        "contract": _last_id("contracts"), "intervention": _last_id("interventions"),
+    }
+
+
+def _sync(e, mutation_type, fields):
+    iid = e["intervention"]
+    return e["tech"].post("/api/tech/sync", json={"mutations": [{
+        "id": "m1", "type": mutation_type, "intervention_id": iid,
+        "base_updated_at": _tech_updated_at(iid), "fields": fields,
+    }]})
+
+
+WRITES = {
+    "customer_create": lambda e: e["admin"].post("/customers", data={"name": "Globex"}, follow_redirects=True),
+    "equipment_create": lambda e: e["admin"].post(
+        "/equipments/new", data={"name": "Boiler", "customer_id": e["customer"]}, follow_redirects=True),
+    "equipment_edit": lambda e: e["admin"].post(
+        f"/equipments/{e['equipment']}/edit", data={"name": "Pump 2", "customer_id": e["customer"]},
+        follow_redirects=True),
+    "contract_create": lambda e: e["admin"].post(
+        "/contracts/new", data={"name": "Silver", "customer_id": e["customer"], "visits_per_year": "1"},
+        follow_redirects=True),
+    "contract_edit": lambda e: e["admin"].post(
+        f"/contracts/{e['contract']}/edit", data={"name": "Gold+", "customer_id": e["customer"],
+                                                  "visits_per_year": "4"}, follow_redirects=True),
+    "contract_delete": lambda e: e["admin"].post(
+        f"/contracts/{e['contract']}/edit", data={"action": "delete"}, follow_redirects=True),
+    "intervention_create": lambda e: e["admin"].post(
+        "/interventions/new", data={"title": "Noise", "client_name": "ACME", "assignees": [str(TECH_ID)]},
+        follow_redirects=True),
+    "intervention_edit": lambda e: e["admin"].post(
+        f"/interventions/{e['intervention']}/edit", data={"title": "Leak (urgent)", "client_name": "ACME",
+                                                          "status": "in_progress", "assignees": [str(TECH_ID)]},
+        follow_redirects=True),
+    "intervention_delete": lambda e: e["admin"].post(
+        f"/interventions/{e['intervention']}/edit", data={"action": "delete"}, follow_redirects=True),
+    "tech_update": lambda e: e["tech"].post(
+        f"/tech/interventions/{e['intervention']}", data={"status": "done", "tech_notes": "fixed"},
+        follow_redirects=True),
+    "tech_upload": lambda e: e["tech"].post(
+        f"/tech/interventions/{e['intervention']}/upload", data={"file": (io.BytesIO(b"report"), "report.txt")},
+        content_type="multipart/form-data", follow_redirects=True),
+    "tech_sign": lambda e: e["tech"].post(
+        f"/tech/interventions/{e['intervention']}/sign",
+        data={"signature_strokes": '{"w":100,"h":50,"strokes":[[1,1,5,5,9,2]]}'}, follow_redirects=True),
+    "tech_sync_update": lambda e: _sync(e, "update", {"tech_notes": "offline note"}),
+    "tech_sync_signature": lambda e: _sync(
+        e, "signature", {"signature_strokes": '{"w":100,"h":50,"strokes":[[2,2,6,6]]}'}),
+    "user_create": lambda e: e["admin"].post(
+        "/admin/users", data={"action": "create", "username": f"tech-{e['intervention']}",
+                              "password": "x" * 12, "role": "tech"}, follow_redirects=True),
+    "company_settings": lambda e: e["admin"].post(
+        "/company/settings", data={"name": f"DemoCompany {e['intervention']}"}, follow_redirects=True),
+}
+
+
+def page_etags(client):
+    tags = {}
+    for page in PAGES:
+        resp = client.get(page)
+        assert resp.status_code == 200, page
+        assert resp.headers.get("ETag"), page
+        tags[page] = resp.headers["ETag"]
+    return tags
+
+
+@pytest.mark.parametrize("write", sorted(WRITES))
+def test_write_changes_every_page_etag(env, write):
+    before = page_etags(env["admin"])
+    resp = WRITES[write](env)
+    assert resp.status_code == 200
+    after = page_etags(env["admin"])
+    assert [p for p in PAGES if before[p] == after[p]] == []
+
+
+def test_unchanged_data_keeps_etags(env):
+    assert page_etags(env["admin"]) == page_etags(env["admin"])
+
+
+def test_language_changes_etags(env):
+    before = page_etags(env["admin"])
+    env["admin"].get("/set_lang/en")
+    try:
+        after = page_etags(env["admin"])
+    finally:
+        env["admin"].get("/set_lang/fr")
+    assert [p for p in PAGES if before[p] == after[p]] == []
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_not_modified_before_any_page_query(env, monkeypatch, page):
+    etag = env["admin"].get(page).headers["ETag"]
+    statements = []
+    connect_ro = mc._connect_ro
+
+    def traced(path):
+        conn = connect_ro(path)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(mc, "_connect_ro", traced)
+    resp = env["admin"].get(page, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    queries = [s for s in statements if not s.startswith("PRAGMA")]
+    assert all("change_log" in s or "company_data_versions" in s for s in queries), queries
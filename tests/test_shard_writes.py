@@ -0,0 +1,50 @@
+"""TENANT_SHARDING: writers on different shards must not serialize on control.db."""
+import os
+import sqlite3
+
+import pytest
+
+import app as mc
+from conftest import TMP
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    monkeypatch.setattr(mc, "TENANT_SHARDING", True)
+    monkeypatch.setattr(mc, "TENANT_DB_DIR", os.path.join(TMP, "tenants"))
+    monkeypatch.setattr(mc, "SQLITE_BUSY_TIMEOUT_SECONDS", 0.2)  # fail fast instead of waiting 10s
+    monkeypatch.setattr(mc, "_ready_shards", set())
+
+
+def _add_customer(conn, company_id, name):
+    conn.execute("INSERT INTO customers (company_id, name, created_at) VALUES (?, ?, ?)",
+                 (company_id, name, "2026-01-01T00:00:00"))
+
+
+def test_concurrent_writes_on_two_shards(sharded):
+    first, second = mc.get_db(1), mc.get_db(2)
+    try:
+        _add_customer(first, 1, "ACME")  # BEGIN IMMEDIATE, kept open
+        _add_customer(second, 2, "Globex")
+        second.commit()
+        control = mc.get_control_db()
+        control.execute("UPDATE companies SET name = name WHERE id = 1")  # logins/admin writes go on too
+        control.commit()
+        control.close()
+        first.commit()
+    finally:
+        first.close()
+        second.close()
+    for company_id, name in ((1, "ACME"), (2, "Globex")):
+        conn = mc.get_read_db(company_id)
+        assert conn.execute("SELECT COUNT(*) FROM customers WHERE name = ?", (name,)).fetchone()[0] == 1
+        conn.close()
+
+
+def test_shard_writer_cannot_write_control(sharded):
+    conn = mc.get_db(1)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("UPDATE control.users SET role = role")
+    finally:
+        conn.close()
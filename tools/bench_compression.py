@@ -0,0 +1,75 @@
+"""Bytes saved vs CPU spent by response compression, per response type.
+
+Seeds a scratch database with interventions, then fetches the interventions
+page (HTML), /api/interventions (JSON) and the CSV export through Flask's test
+client with each Accept-Encoding, reporting body size and server CPU time.
+
+Usage:
+    python tools/bench_compression.py
+    python tools/bench_compression.py --rows 5000 -n 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROUTES = [
+    ("html", "/interventions"),
+    ("json", "/api/interventions"),
+    ("csv", "/interventions/export/csv"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="interventions to seed")
+    parser.add_argument("-n", "--iterations", type=int, default=10, help="requests per route and encoding")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="mc_bench_")
+    os.environ["MAINTCONTROL_DB"] = os.path.join(tmpdir, "bench.db")
+    os.environ.pop("ADMIN_USERNAME", None)
+    os.environ.pop("ADMIN_PASSWORD", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as mc
+
+    mc.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    conn = mc.get_db()
+    now = mc.datetime.utcnow().isoformat()
+    conn.execute("UPDATE users SET password = ? WHERE username = 'admin'", (mc.hash_password("bench"),))
+    conn.executemany(
+        "INSERT INTO interventions (company_id, title, description, client_name, status, priority, kind, category, scheduled_date, created_at) "
+        "VALUES (1, ?, ?, ?, ?, ?, 'corrective', 'hvac', ?, ?)",
+        [(f"Intervention {i}", f"Panne chaudière bâtiment {i % 40}, vérifier brûleur et pressostat.",
+          f"Client {i % 200}", ("open", "in_progress", "done")[i % 3], ("low", "medium", "high")[i % 3], now, now)
+         for i in range(args.rows)],
+    )
+    conn.commit()
+    conn.close()
+
+    client = mc.app.test_client()
+    client.post("/login", data={"username": "admin", "password": "bench"})
+
+    encodings = ["identity", "gzip"] + (["br"] if mc.brotli is not None else [])
+    print(f"{'type':<6} {'encoding':<9} {'bytes':>10} {'saved':>7} {'cpu ms':>8} {'extra cpu ms':>13}")
+    for label, url in ROUTES:
+        baseline_size = baseline_cpu = None
+        for enc in encodings:
+            sizes, cpu = [], []
+            for _ in range(args.iterations):
+                t0 = time.process_time()
+                resp = client.get(url, headers={"Accept-Encoding": enc})
+                body = resp.get_data()
+                cpu.append(time.process_time() - t0)
+                sizes.append(len(body))
+            size, cpu_ms = sizes[-1], statistics.median(cpu) * 1000
+            if baseline_size is None:
+                baseline_size, baseline_cpu = size, cpu_ms
+            saved = 100.0 * (1 - size / baseline_size) if baseline_size else 0.0
+            print(f"{label:<6} {enc:<9} {size:>10} {saved:>6.1f}% {cpu_ms:>8.2f} {cpu_ms - baseline_cpu:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Login latency benchmark per password hashing policy.
+
+Runs the real /login route through Flask's test client against a scratch
+database and reports p50/p99 latency and single-core throughput for each
+Werkzeug hash method, plus the cost of hashing a new password (user creation).
+
+Usage:
+    python tools/bench_login.py
+    python tools/bench_login.py -n 200 -p "pbkdf2:sha256:600000" -p "scrypt:32768:8:1"
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DEFAULT_POLICIES = [
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=50, help="logins per policy")
+    parser.add_argument("-p", "--policy", action="append", dest="policies", help="Werkzeug hash method (repeatable)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="mc_bench_")
+    os.environ["MAINTCONTROL_DB"] = os.path.join(tmpdir, "bench.db")
+    os.environ.pop("ADMIN_USERNAME", None)
+    os.environ.pop("ADMIN_PASSWORD", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as mc
+
+    mc.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    client = mc.app.test_client()
+
+    print(f"{'policy':<26} {'hash ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'logins/s/core':>14}")
+    for policy in args.policies or DEFAULT_POLICIES:
+        mc.PASSWORD_HASH_METHOD = policy
+        mc.PASSWORD_HASH_PREFIX = mc._normalized_hash_method(policy)
+
+        t0 = time.perf_counter()
+        pw_hash = mc.hash_password("bench-password")
+        hash_ms = (time.perf_counter() - t0) * 1000
+
+        conn = mc.get_db()
+        conn.execute("DELETE FROM users WHERE username = 'bench'")
+        conn.execute(
+            "INSERT INTO users (username, password, role, company_id, created_at, trial_start, is_activated) "
+            "VALUES ('bench', ?, 'tech', 1, ?, ?, 1)",
+            (pw_hash, mc.datetime.utcnow().isoformat(), mc.datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+        conn.close()
+
+        samples = []
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            resp = client.post("/login", data={"username": "bench", "password": "bench-password"})
+            samples.append(time.perf_counter() - t0)
+            if resp.status_code != 302:
+                raise SystemExit(f"login failed for policy {policy}")
+            client.get("/logout")
+
+        mean = statistics.mean(samples)
+        print(f"{policy:<26} {hash_ms:>9.1f} {percentile(samples, 50) * 1000:>9.1f} "
+              f"{percentile(samples, 99) * 1000:>9.1f} {1 / mean:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Compact the change_log table read by /api/changes.
+
+The app already compacts opportunistically (every CHANGE_LOG_COMPACT_INTERVAL_SECONDS,
+on feed requests); this script is meant for a cron job so the log stays bounded even
+when nobody polls the feed. Handles the single database and every shard of
+TENANT_DB_DIR when TENANT_SHARDING=1.
+
+Usage:
+    python tools/compact_change_log.py
+"""
+import os
+import sys
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as mc
+
+    if mc.TENANT_SHARDING:
+        ctl = mc.get_control_db()
+        targets = [row["id"] for row in ctl.execute("SELECT id FROM companies ORDER BY id")]
+        ctl.close()
+    else:
+        targets = [None]
+
+    for company_id in targets:
+        conn = mc.get_db(company_id) if company_id is not None else mc.get_control_db()
+        deleted = mc.compact_change_log(conn.cursor())
+        conn.commit()
+        conn.close()
+        label = f"company {company_id}" if company_id is not None else mc.DATABASE
+        print(f"{label}: {deleted} change_log rows removed")
+
+
+if __name__ == "__main__":
+    main()
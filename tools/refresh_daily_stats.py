@@ -0,0 +1,42 @@
+"""Refresh the daily_company_stats rollup served by /api/stats/daily.
+
+Incremental by default: only interventions changed since the previous run (according to
+change_log) are reprocessed. Run it from cron so charts stay current even when nobody
+opens them; /api/stats/daily also refreshes when the rollup is older than
+DAILY_STATS_REFRESH_INTERVAL_SECONDS. Handles every shard when TENANT_SHARDING=1.
+
+Usage:
+    python tools/refresh_daily_stats.py          # incremental
+    python tools/refresh_daily_stats.py --full   # rebuild from the interventions table
+"""
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="recompute every day instead of the touched ones")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as mc
+
+    if mc.TENANT_SHARDING:
+        ctl = mc.get_control_db()
+        targets = [row["id"] for row in ctl.execute("SELECT id FROM companies ORDER BY id")]
+        ctl.close()
+    else:
+        targets = [None]
+
+    for company_id in targets:
+        conn = mc.get_db(company_id) if company_id is not None else mc.get_control_db()
+        count = mc.refresh_daily_stats(conn.cursor(), full=args.full)
+        conn.commit()
+        conn.close()
+        label = f"company {company_id}" if company_id is not None else mc.DATABASE
+        print(f"{label}: {count} interventions reprocessed")
+
+
+if __name__ == "__main__":
+    main()
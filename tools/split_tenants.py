@@ -0,0 +1,80 @@
+"""Split the single database into one SQLite file per company.
+
+Copies customers, equipments, contracts, interventions, intervention_files and
+intervention_assignees of every company from DATABASE (MAINTCONTROL_DB) into
+TENANT_DB_DIR/company_<id>.db. Companies, users and licensing stay in DATABASE,
+which becomes the control database. Start the app with TENANT_SHARDING=1 afterwards.
+
+Usage:
+    python tools/split_tenants.py            # copy, keep the source rows
+    python tools/split_tenants.py --purge    # copy, then delete tenant rows from DATABASE and VACUUM
+    python tools/split_tenants.py --force    # overwrite existing shard files
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+
+def table_columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--purge", action="store_true", help="delete copied rows from the source database")
+    parser.add_argument("--force", action="store_true", help="replace existing shard files")
+    args = parser.parse_args()
+
+    # Import in single-database mode so the source schema is migrated to the latest version.
+    os.environ.pop("TENANT_SHARDING", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as mc
+
+    src = mc.get_control_db()
+    companies = [row["id"] for row in src.execute("SELECT id FROM companies ORDER BY id")]
+    src.close()
+    os.makedirs(mc.TENANT_DB_DIR, exist_ok=True)
+
+    for company_id in companies:
+        path = mc.tenant_db_path(company_id)
+        if os.path.exists(path):
+            if not args.force:
+                print(f"company {company_id}: {path} exists, skipped (use --force)")
+                continue
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)  # stale WAL frames would be replayed into the new file
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("ATTACH DATABASE ? AS control", (mc.DATABASE,))
+        c = conn.cursor()
+        mc.migrate_tenant_db(c, users_table="directory_users")
+        mc.sync_user_directory(c, company_id)
+        counts = []
+        for table in mc.TENANT_TABLES:
+            cols = [col for col in table_columns(conn, "main", table) if col in table_columns(conn, "control", table)]
+            col_list = ", ".join(cols)
+            c.execute(f"INSERT INTO main.{table} ({col_list}) SELECT {col_list} FROM control.{table} WHERE company_id = ?",
+                      (company_id,))
+            counts.append(f"{table}={c.rowcount}")
+        # The copy fired the change_log triggers: start the shard's feed empty. Clients
+        # holding a cursor from the single database are sent a reset (since > head).
+        c.execute("DELETE FROM change_log")
+        c.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+        conn.commit()
+        conn.close()
+        print(f"company {company_id}: {path} ({', '.join(counts)})")
+
+    if args.purge:
+        src = mc.get_control_db()
+        for table in reversed(mc.TENANT_TABLES):
+            src.execute(f"DELETE FROM {table}")
+        src.commit()
+        src.execute("VACUUM")
+        src.close()
+        print("tenant rows removed from", mc.DATABASE)
+
+
+if __name__ == "__main__":
+    main()